@@ -5,7 +5,7 @@
 
 import time, os, sys
 
-from hardware import RFReceiver, AnimatedDisplay
+from hardware import RFReceiver, AnimatedDisplay, latency
 
 from screens import Manager
 import screens.sonos as sonos
@@ -15,6 +15,7 @@ if __name__ == "__main__":
         print("Must be run as root!",file=sys.stderr)
         exit(5)
     os.nice(-10)
+    latency.install() # kill -USR1 dumps ~/.homectrl/latency.txt
     manager = Manager(AnimatedDisplay(), RFReceiver())
     top = sonos.PlayerSelection(manager.display)
     manager.launch(top)
@@ -1,4 +1,4 @@
 
-
+from .bus import *
 from .display import *
 from .rf import *
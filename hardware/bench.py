@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+# Display bus benchmark.
+#
+#   python3 -m hardware.bench            # simulated HD44780
+#   sudo python3 -m hardware.bench --gpio   # the real display
+#
+# Reports achieved bytes/second through Display.writeBytes() and, on the
+# simulator, bus transactions per frame for a typical Now Playing update
+# and any instructions that were sent while the controller was busy.
+#
+
+import argparse, time
+
+try:
+    from . import bus, display, timing
+except SystemError:
+    import bus, display, timing
+
+def throughput(dis,seconds):
+    payload = bytes(range(0x41,0x41+display.COLS))
+    sent = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        dis.move(0,0)
+        dis.writeBytes(payload)
+        sent += len(payload) + 1
+    return sent / (time.perf_counter() - start)
+
+def now_playing_frames(dis,frames):
+    for i in range(frames):
+        dis.insert(0,0,"Song title number {}".format(i % 3))
+        dis.insert(3,3,"{}:{:02d}".format(i // 60, i % 60))
+    dis.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Display bus benchmark")
+    parser.add_argument("--gpio", action="store_true",
+                        help="benchmark the real display through RPi.GPIO")
+    parser.add_argument("--multipin", action="store_true",
+                        help="with --gpio, set each nibble in one call")
+    parser.add_argument("--rw", type=int, default=None, metavar="PIN",
+                        help="poll the busy flag through R/W on this pin")
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args()
+
+    lcd = None
+    if args.gpio:
+        dbus = bus.MultiPinGPIOBus() if args.multipin else bus.GPIOBus()
+    else:
+        hw = bus.SimulatedHardware(display_pins=(
+            display.RS, display.EN, (display.D7, display.D6, display.D5,
+                                     display.D4), args.rw))
+        dbus, lcd = hw.bus, hw.lcd
+
+    print("sleep slack: {:.1f} us".format(timing.sleep_slack()/1000))
+    print("datasheet limit: {:.0f} bytes/s".format(
+        1e9/timing.DATA_EXEC_TIME))
+    with display.ManagedDisplay(rw=args.rw,bus=dbus) as dis:
+        print("achieved: {:.0f} bytes/s".format(
+            throughput(dis,args.seconds)))
+        if lcd is not None:
+            dis.clear()
+            dbus.reset_stats()
+            now_playing_frames(dis,args.frames)
+            print("per frame: {:.1f} transactions, {:.1f} pin writes".format(
+                lcd.transactions/args.frames, dbus.writes/args.frames))
+            print("timing violations: {}".format(len(lcd.violations)))
+
+if __name__ == "__main__":
+    main()
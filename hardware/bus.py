@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+#
+# Pin-level bus backends used by Component and its subclasses.
+#
+# GPIOBus drives real pins through RPi.GPIO (BOARD numbering) and is only
+# imported when one is actually constructed, so everything else in this
+# package can be used off a Pi with a SimulatedBus instead.
+#
+
+import time, threading, collections
+
+try:
+    from .timing import (ENABLE_PULSE, EXEC_TIME, DATA_EXEC_TIME,
+                         LONG_EXEC_TIME)
+except SystemError:
+    from timing import ENABLE_PULSE, EXEC_TIME, DATA_EXEC_TIME, LONG_EXEC_TIME
+
+LOW = 0
+HIGH = 1
+
+RISING = "rising"
+FALLING = "falling"
+BOTH = "both"
+
+class Bus:
+    def setup_output(self,pin,initial=LOW):
+        raise NotImplementedError
+
+    def setup_input(self,pin):
+        raise NotImplementedError
+
+    def output(self,pin,level):
+        raise NotImplementedError
+
+    def output_many(self,pins,levels):
+        for pin, level in zip(pins,levels):
+            self.output(pin,level)
+
+    def input(self,pin):
+        raise NotImplementedError
+
+    def add_event_detect(self,pin,callback,edge=RISING,bouncetime=None):
+        raise NotImplementedError
+
+    def remove_event_detect(self,pin):
+        raise NotImplementedError
+
+    def cleanup(self,pin):
+        pass
+
+class GPIOBus(Bus):
+    def __init__(self):
+        import RPi.GPIO as gpio
+        self.gpio = gpio
+        gpio.setmode(gpio.BOARD)
+        self.output = gpio.output
+        self.input = gpio.input
+        self.__edges = {RISING: gpio.RISING, FALLING: gpio.FALLING,
+                        BOTH: gpio.BOTH}
+
+    def setup_output(self,pin,initial=LOW):
+        self.gpio.setup(pin, self.gpio.OUT, initial=initial)
+
+    def setup_input(self,pin):
+        self.gpio.setup(pin, self.gpio.IN)
+
+    def add_event_detect(self,pin,callback,edge=RISING,bouncetime=None):
+        kwargs = {"callback": lambda ch: callback(pin)}
+        if bouncetime:
+            kwargs["bouncetime"] = bouncetime
+        self.gpio.add_event_detect(pin, self.__edges[edge], **kwargs)
+
+    def remove_event_detect(self,pin):
+        self.gpio.remove_event_detect(pin)
+
+    def cleanup(self,pin):
+        self.gpio.cleanup(pin)
+
+class MultiPinGPIOBus(GPIOBus):
+    # RPi.GPIO accepts lists of channels and levels, which sets a whole
+    # nibble with one call into the C extension.
+    def output_many(self,pins,levels):
+        self.gpio.output(list(pins), list(levels))
+
+_default_bus = None
+
+def default_bus():
+    global _default_bus
+    if _default_bus is None:
+        _default_bus = GPIOBus()
+    return _default_bus
+
+def set_default_bus(bus):
+    global _default_bus
+    _default_bus = bus
+
+#
+# Simulation
+#
+
+Transition = collections.namedtuple("Transition", "time pin level")
+
+class SimulatedBus(Bus):
+    # Keeps every pin level in memory and records each transition with a
+    # perf_counter_ns() timestamp. Devices attached with attach() see every
+    # change on the pins they list, and external signals (e.g. the RF
+    # receiver outputs) are driven with drive().
+    def __init__(self,history=100000,clock=time.perf_counter_ns):
+        self.clock = clock
+        self.levels = {}
+        self.directions = {}
+        self.transitions = collections.deque(maxlen=history)
+        self.writes = 0
+        self.devices = []
+        self.__listeners = collections.defaultdict(list)
+        self.__detectors = {}
+        self.__lock = threading.RLock()
+
+    def attach(self,device):
+        self.devices.append(device)
+        for pin in device.pins:
+            self.__listeners[pin].append(device)
+        return device
+
+    def reset_stats(self):
+        with self.__lock:
+            self.writes = 0
+            self.transitions.clear()
+            for i in self.devices:
+                i.reset_stats()
+
+    def setup_output(self,pin,initial=LOW):
+        self.directions[pin] = "out"
+        self.output(pin,initial)
+
+    def setup_input(self,pin):
+        self.directions[pin] = "in"
+        self.levels.setdefault(pin,LOW)
+
+    def __set(self,pin,level,now):
+        level = HIGH if level else LOW
+        if self.levels.get(pin) == level:
+            return False
+        self.levels[pin] = level
+        self.transitions.append(Transition(now,pin,level))
+        return True
+
+    def output(self,pin,level):
+        with self.__lock:
+            if self.directions.get(pin) != "out":
+                raise RuntimeError("Pin {} is not set up as an output".format(pin))
+            now = self.clock()
+            self.writes += 1
+            if self.__set(pin,level,now):
+                for i in self.__listeners[pin]:
+                    i.on_output(pin,self.levels[pin],now)
+
+    def output_many(self,pins,levels):
+        with self.__lock:
+            now = self.clock()
+            changed = []
+            for pin, level in zip(pins,levels):
+                if self.directions.get(pin) != "out":
+                    raise RuntimeError(
+                        "Pin {} is not set up as an output".format(pin))
+                self.writes += 1
+                if self.__set(pin,level,now):
+                    changed.append(pin)
+            for pin in changed:
+                for i in self.__listeners[pin]:
+                    i.on_output(pin,self.levels[pin],now)
+
+    def input(self,pin):
+        with self.__lock:
+            for i in self.__listeners[pin]:
+                level = i.read(pin,self.clock())
+                if level is not None:
+                    return level
+            return self.levels.get(pin,LOW)
+
+    def drive(self,pin,level):
+        with self.__lock:
+            now = self.clock()
+            if not self.__set(pin,level,now):
+                return
+            detector = self.__detectors.get(pin)
+        if detector:
+            callback, edge, bouncetime, last = detector
+            if edge != BOTH and (edge == RISING) != bool(level):
+                return
+            if bouncetime and last is not None and \
+               now - last < bouncetime * 1000000:
+                return
+            detector[3] = now
+            callback(pin)
+
+    def add_event_detect(self,pin,callback,edge=RISING,bouncetime=None):
+        self.__detectors[pin] = [callback, edge, bouncetime, None]
+
+    def remove_event_detect(self,pin):
+        self.__detectors.pop(pin,None)
+
+    def cleanup(self,pin):
+        self.directions.pop(pin,None)
+        self.__detectors.pop(pin,None)
+
+DDRAM_SIZE = 80
+
+class SimulatedHD44780:
+    # A 4-bit-wired HD44780 with 2-line addressing (as used for 20x4
+    # modules). Instructions are decoded on the falling edge of EN, and any
+    # instruction that arrives before the previous one has finished
+    # executing is recorded in violations (and ignored if strict). With R/W
+    # wired, reads return the busy flag and address counter.
+    def __init__(self,rs,en,data_pins,rw=None,cols=20,rows=4,strict=False):
+        self.RS = rs
+        self.EN = en
+        self.RW = rw
+        self.data_pins = tuple(data_pins) # D7..D4
+        self.pins = (rs, en) + self.data_pins + ((rw,) if rw else ())
+        self.cols = cols
+        self.rows = rows
+        self.strict = strict
+        self.levels = {pin: LOW for pin in self.pins}
+        self.power_on()
+        self.reset_stats()
+
+    def power_on(self):
+        self.ddram = bytearray(b" " * DDRAM_SIZE)
+        self.cgram = bytearray(64)
+        self.address = 0
+        self.cgram_mode = False
+        self.increment = True
+        self.display_on = False
+        self.cursor = False
+        self.blink = False
+        self.four_bit = False
+        self.two_line = False
+        self.busy_until = 0
+        self.__high_nibble = None
+        self.__enable_rise = None
+        self.__read_low = False
+
+    def reset_stats(self):
+        self.commands = 0
+        self.data = 0
+        self.nibbles = 0
+        self.reads = 0
+        self.violations = []
+
+    @property
+    def transactions(self):
+        return self.commands + self.data
+
+    def busy(self,now):
+        return now < self.busy_until
+
+    def on_output(self,pin,level,now):
+        self.levels[pin] = level
+        if pin != self.EN:
+            return
+        if level:
+            self.__enable_rise = now
+            return
+        if self.__enable_rise is not None and \
+           now - self.__enable_rise < ENABLE_PULSE:
+            self.violations.append((now, "enable pulse too short"))
+        if self.RW and self.levels[self.RW]:
+            self.reads += 1
+            self.__read_low = not self.__read_low
+            return
+        nibble = 0
+        for i in self.data_pins:
+            nibble = (nibble << 1) | self.levels[i]
+        self.nibbles += 1
+        rs = self.levels[self.RS]
+        if not self.four_bit:
+            self.__execute(rs, nibble << 4, now)
+        elif self.__high_nibble is None:
+            self.__high_nibble = nibble
+        else:
+            value = (self.__high_nibble << 4) | nibble
+            self.__high_nibble = None
+            self.__execute(rs, value, now)
+
+    def read(self,pin,now):
+        if not (self.RW and self.levels[self.RW] and self.levels[self.EN]):
+            return None
+        if pin not in self.data_pins or self.levels[self.RS]:
+            return None
+        value = (self.busy(now) << 7) | (self.address & 0x7f)
+        nibble = value & 0xf if self.__read_low else value >> 4
+        return (nibble >> (3 - self.data_pins.index(pin))) & 1
+
+    def __execute(self,rs,value,now):
+        if self.busy(now):
+            self.violations.append(
+                (now, "{} 0x{:02x} sent while busy".format(
+                    "data" if rs else "command", value)))
+            if self.strict:
+                return
+        if rs:
+            self.data += 1
+            self.__write(value)
+            self.busy_until = now + DATA_EXEC_TIME
+            return
+        self.commands += 1
+        duration = EXEC_TIME
+        if value & 0x80:
+            self.address = value & 0x7f
+            self.cgram_mode = False
+        elif value & 0x40:
+            self.address = value & 0x3f
+            self.cgram_mode = True
+        elif value & 0x20:
+            self.four_bit = not value & 0x10
+            self.two_line = bool(value & 0x08)
+        elif value & 0x10:
+            pass # cursor/display shift
+        elif value & 0x08:
+            self.display_on = bool(value & 0x04)
+            self.cursor = bool(value & 0x02)
+            self.blink = bool(value & 0x01)
+        elif value & 0x04:
+            self.increment = bool(value & 0x02)
+        elif value & 0x02:
+            self.address = 0
+            self.cgram_mode = False
+            duration = LONG_EXEC_TIME
+        elif value & 0x01:
+            self.ddram[:] = b" " * DDRAM_SIZE
+            self.address = 0
+            self.cgram_mode = False
+            self.increment = True
+            duration = LONG_EXEC_TIME
+        self.busy_until = now + duration
+
+    def __write(self,value):
+        step = 1 if self.increment else -1
+        if self.cgram_mode:
+            self.cgram[self.address] = value
+            self.address = (self.address + step) % len(self.cgram)
+            return
+        self.ddram[self.__ddram_index(self.address)] = value
+        address = self.address + step
+        if self.two_line:
+            if address == 0x28:
+                address = 0x40
+            elif address == 0x68:
+                address = 0x00
+            elif address == 0x3f:
+                address = 0x27
+            elif address == -1:
+                address = 0x67
+        self.address = address % 0x80
+
+    def __ddram_index(self,address):
+        if self.two_line:
+            return (address - 0x40 + 40) if address >= 0x40 else address
+        return address % DDRAM_SIZE
+
+    def row_address(self,row):
+        return (0x40 if row % 2 else 0) + (self.cols if row >= 2 else 0)
+
+    def text(self,row=None):
+        if row is None:
+            return "\n".join(self.text(i) for i in range(self.rows))
+        start = self.__ddram_index(self.row_address(row))
+        return self.ddram[start:start+self.cols].decode("latin-1")
+
+    def glyph(self,index):
+        return tuple(self.cgram[index*8:index*8+8])
+
+class SimulatedRFReceiver:
+    # Drives the outputs of the 4-channel RF receiver on a SimulatedBus.
+    def __init__(self,bus,pins):
+        self.bus = bus
+        self.pins = tuple(pins)
+
+    def press(self,button,hold=0.05):
+        pin = self.pins[button]
+        self.bus.drive(pin,HIGH)
+        if hold:
+            time.sleep(hold)
+        self.bus.drive(pin,LOW)
+
+class SimulatedHardware:
+    # Convenience bundle: a SimulatedBus with an HD44780 on the display pins
+    # and an RF receiver on the receiver pins (defaults from display/rf).
+    def __init__(self,display_pins=None,rf_pins=None,**kwargs):
+        try:
+            from . import display, rf
+        except SystemError:
+            import display, rf
+        if display_pins is None:
+            display_pins = (display.RS, display.EN, (display.D7, display.D6,
+                                                     display.D5, display.D4))
+        if rf_pins is None:
+            rf_pins = (rf.A, rf.B, rf.C, rf.D)
+        self.bus = SimulatedBus()
+        rs, en, data_pins = display_pins[:3]
+        self.lcd = self.bus.attach(
+            SimulatedHD44780(rs, en, data_pins, *display_pins[3:], **kwargs))
+        self.rf = SimulatedRFReceiver(self.bus, rf_pins)
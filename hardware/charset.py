@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+#
+# Unicode <-> HD44780 character ROM (A00, Japanese) translation.
+#
+# The A00 ROM is ASCII for 0x20-0x7d except that 0x5c is a yen sign and
+# 0x7e/0x7f are arrows, with katakana and a handful of Greek, accented and
+# math characters above 0xa0. Anything else is folded to its unaccented
+# form, given a CGRAM bitmap in GLYPHS, or replaced with FALLBACK.
+#
+# Codes 0x00-0x07 are the CGRAM slots and pass through unchanged, so the
+# characters returned by Display.glyph() can be mixed into text.
+#
+
+import unicodedata, functools
+
+FALLBACK = ord("?")
+
+# Characters the ROM has at a different code than Latin-1 would put them
+ROM = {
+    "\n": 0x0a, # never displayed; lets wrapped inserts find line breaks
+    "¥": 0x5c, "→": 0x7e, "←": 0x7f,
+    "｡": 0xa1, "「": 0xa2, "」": 0xa3, "、": 0xa4, "・": 0xa5, "·": 0xa5,
+    "•": 0xa5, "ー": 0xb0, "°": 0xdf, "º": 0xdf,
+    "α": 0xe0, "ä": 0xe1, "β": 0xe2, "ß": 0xe2, "ε": 0xe3, "μ": 0xe4,
+    "µ": 0xe4, "σ": 0xe5, "ρ": 0xe6, "√": 0xe8, "¢": 0xec, "£": 0xed,
+    "ñ": 0xee, "ö": 0xef, "θ": 0xf2, "∞": 0xf3, "Ω": 0xf4, "ü": 0xf5,
+    "Σ": 0xf6, "π": 0xf7, "÷": 0xfd, "█": 0xff,
+}
+ROM.update({chr(i): i for i in range(8)})
+ROM.update({chr(i): i for i in range(0x20, 0x7e) if i != 0x5c})
+
+# Punctuation that titles commonly use but that has no ROM glyph
+SUBSTITUTES = {
+    "‘": "'", "’": "'", "‚": ",", "′": "'", "“": '"', "”": '"', "„": '"',
+    "″": '"', "–": "-", "—": "-", "‐": "-", "−": "-", "…": ".", "×": "x",
+    "«": "<", "»": ">", "¡": "!", "¿": "?", " ": " ", "\t": " ",
+    "Æ": "A", "æ": "a", "Ø": "O", "ø": "o", "Œ": "O", "œ": "o", "Ð": "D",
+    "ð": "d", "Þ": "P", "þ": "p", "Ł": "L", "ł": "l", "đ": "d", "Đ": "D",
+}
+
+# CGRAM bitmaps (5x8, top row first) for characters missing from the ROM
+GLYPHS = {
+    "\\": (0x00,0x10,0x08,0x04,0x02,0x01,0x00,0x00),
+    "~": (0x00,0x00,0x08,0x15,0x02,0x00,0x00,0x00),
+    "Ä": (0x0a,0x00,0x0e,0x11,0x1f,0x11,0x11,0x00),
+    "Ö": (0x0a,0x00,0x0e,0x11,0x11,0x11,0x0e,0x00),
+    "Ü": (0x0a,0x00,0x11,0x11,0x11,0x11,0x0e,0x00),
+}
+
+# Sentinel written where a GLYPHS character goes, until a slot is known
+PENDING = 0x0f
+
+DECODE = {code: char for char, code in reversed(list(ROM.items()))}
+DECODE.update({i: chr(i) for i in range(8)})
+DECODE[PENDING] = "?"
+
+@functools.lru_cache(maxsize=4096)
+def translate(char):
+    # ROM code for one character, or None if it needs a CGRAM glyph
+    if char in ROM:
+        return ROM[char]
+    if char in GLYPHS:
+        return None
+    if char in SUBSTITUTES:
+        return translate(SUBSTITUTES[char])
+    base = "".join(i for i in unicodedata.normalize("NFKD", char)
+                   if not unicodedata.combining(i))
+    if len(base) == 1 and base != char:
+        return translate(base)
+    return FALLBACK
+
+@functools.lru_cache(maxsize=1024)
+def encode(text):
+    # (bytes, ((position, bitmap), ...)) for text; the positions hold
+    # PENDING and are filled in by the display once it has a slot.
+    data = bytearray()
+    glyphs = []
+    for char in text:
+        code = translate(char)
+        if code is None:
+            glyphs.append((len(data), GLYPHS[char]))
+            code = PENDING
+        data.append(code)
+    return bytes(data), tuple(glyphs)
+
+def decode(data):
+    return "".join(DECODE.get(i, "?") for i in data)
@@ -2,14 +2,19 @@
 # Base classes for GPIO hardware
 #
 
-import RPi.GPIO as gpio
-import time
+try:
+    from .bus import default_bus
+    from . import timing
+except SystemError:
+    from bus import default_bus
+    import timing
 
 def delay(microseconds):
-    time.sleep(microseconds/1000000)
+    timing.wait_ns(microseconds*1000)
 
 class Component:
-    def __init__(self,outpins=(),inpins=()):
+    def __init__(self,outpins=(),inpins=(),bus=None):
+        self.bus = bus or default_bus()
         self.__out_pins = outpins
         self.__in_pins = inpins
         self.__initialized = False
@@ -27,13 +32,12 @@ class Component:
                 self.cleanup()
             finally:
                 pass
-            
-        gpio.setmode(gpio.BOARD)
+
 
         for ch in self.__out_pins:
-            gpio.setup(ch, gpio.OUT, initial=gpio.LOW)
+            self.bus.setup_output(ch)
         for ch in self.__in_pins:
-            gpio.setup(ch, gpio.IN)
+            self.bus.setup_input(ch)
 
         if not wait_set_init:
             self.__initialized = True
@@ -46,7 +50,7 @@ class Component:
             return False
         self.__initialized = False
         for ch in self.__out_pins + self.__in_pins:
-            gpio.cleanup(ch)
+            self.bus.cleanup(ch)
         
     def __enter__(self):
         self.init()
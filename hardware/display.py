@@ -10,14 +10,19 @@
 #
 # Backlight: 18
 #
+# R/W is optional; when it is wired (and passed as rw=) the busy flag is
+# polled instead of assuming worst-case instruction times.
+#
 
-import RPi.GPIO as gpio
-import time, threading, sys, atexit
+import time, math, threading, queue, sys, atexit, traceback, collections
+import contextlib
 
 try:
     from .component import Component, delay
+    from . import timing, charset, latency
 except SystemError:
     from component import Component, delay
+    import timing, charset, latency
 
 RS = 18 # 24
 EN = 22 # 25
@@ -28,6 +33,11 @@ D4 = 15 # 22
 
 BACKLIGHT = 12 # 18
 
+RW = None # not wired
+
+BUSY_TIMEOUT = 10000000 # ns
+BUSY_POLL_MIN = 100000 # ns; shorter waits are just timed
+
 ROWS = 4
 COLS = 20
 
@@ -37,31 +47,45 @@ SHIFT_MASK = 0b00010000
 RIGHT = 0b0100
 LEFT  = 0b0000
 
+# Pin levels for (D7, D6, D5, D4) for every nibble, and the (high, low)
+# nibble pair for every byte, so the write path is just table lookups.
+NIBBLE_LEVELS = tuple(tuple((n >> (3-i)) & 1 for i in range(4))
+                      for n in range(16))
+BYTE_LEVELS = tuple((NIBBLE_LEVELS[b >> 4], NIBBLE_LEVELS[b & 0xf])
+                    for b in range(256))
+
 _displays = []
 
 def _kill_all():
     for i in _displays:
         if i._checkInit(True):
             i.enabled = False
+            i.flush()
 
 atexit.register(_kill_all)
 
 class Display(Component):
-    def __init__(self,rs=RS,en=EN,d7=D7,d6=D6,d5=D5,d4=D4,bl=BACKLIGHT):
+    def __init__(self,rs=RS,en=EN,d7=D7,d6=D6,d5=D5,d4=D4,bl=BACKLIGHT,
+                 rw=RW,bus=None):
         self.RS = rs
         self.EN = en
+        self.RW = rw
         self.D7 = d7
         self.D6 = d6
         self.D5 = d5
         self.D4 = d4
         self.BACKLIGHT = bl
         self.data_pins = (d7, d6, d5, d4)
-        super().__init__((rs, en, bl) + self.data_pins)
+        self.busy_poll = rw is not None
+        super().__init__((rs, en, bl) + self.data_pins +
+                         ((rw,) if rw is not None else ()), bus=bus)
 
         self.lock = threading.RLock()
         self.__mode = 0b000
         self.__lit = False
-        self._next_custom_char = 0
+        self._glyphs = collections.OrderedDict()
+        self._glyph_lock = threading.RLock()
+        self._ready_at = 0
         _displays.append(self)
         
     @property
@@ -73,7 +97,7 @@ class Display(Component):
         if (not self.enabled) and state:
             self.enabled = True
         self._checkInit()
-        gpio.output(self.BACKLIGHT,state)
+        self.bus.output(self.BACKLIGHT,state)
         self.__lit = state
 
     def __changeMode(self,mask,state):
@@ -110,32 +134,87 @@ class Display(Component):
     def blink(self,state):
         self.__changeMode(0b001,state)
 
+    # Rather than sleeping a fixed time after every pulse, each byte records
+    # when the controller will be ready again (per its datasheet execution
+    # time) and the next pulse waits for that, overlapping the wait with
+    # whatever Python work happens in between.
     def __pulseEnable(self):
-        gpio.output(self.EN,0)
-        delay(1)
-        gpio.output(self.EN,1)
-        delay(1)
-        gpio.output(self.EN,0)
-        delay(100)
+        timing.wait_until(self._ready_at)
+        self.bus.output(self.EN,1)
+        timing.wait_ns(timing.ENABLE_PULSE)
+        self.bus.output(self.EN,0)
 
     def __write4(self,val):
-        for n, i in enumerate(self.data_pins):
-            gpio.output(i, (val >> (3-n)) & 1)
+        self.bus.output_many(self.data_pins,NIBBLE_LEVELS[val & 0xf])
         self.__pulseEnable()
-
-    def write(self,val,mode=1):
+        self._ready_at = timing.now() + timing.EXEC_TIME
+
+    def __readBusy(self):
+        self.bus.output(self.EN,1)
+        timing.wait_ns(timing.ENABLE_PULSE)
+        busy = self.bus.input(self.D7)
+        self.bus.output(self.EN,0)
+        # The second read returns the low address bits, which we ignore
+        self.bus.output(self.EN,1)
+        timing.wait_ns(timing.ENABLE_PULSE)
+        self.bus.output(self.EN,0)
+        return busy
+
+    def __waitBusy(self,mode):
+        bus = self.bus
+        for i in self.data_pins:
+            bus.setup_input(i)
+        bus.output(self.RS,0)
+        bus.output(self.RW,1)
+        try:
+            deadline = timing.now() + BUSY_TIMEOUT
+            while self.__readBusy():
+                # Re-read so that being descheduled is not mistaken for a
+                # stuck flag
+                if timing.now() > deadline and self.__readBusy():
+                    print("Busy flag stuck high, falling back to fixed timings",
+                          file=sys.stderr)
+                    self.busy_poll = False
+                    return
+            self._ready_at = 0
+        finally:
+            bus.output(self.RW,0)
+            for i in self.data_pins:
+                bus.setup_output(i)
+            bus.output(self.RS,mode)
+
+    def writeBytes(self,data,mode=1):
         with self.lock:
             self._checkInit()
-            gpio.output(self.RS,mode)
-            self.__write4(val>>4)
-            self.__write4(val)
-        
+            output_many = self.bus.output_many
+            pins = self.data_pins
+            pulse = self.__pulseEnable
+            now = timing.now
+            exec_time = timing.DATA_EXEC_TIME
+            self.bus.output(self.RS,mode)
+            for i in data:
+                # Polling costs more bus cycles than a short wait, so it is
+                # only worth it while a long instruction is still running.
+                if self.busy_poll and \
+                   self._ready_at - now() > BUSY_POLL_MIN:
+                    self.__waitBusy(mode)
+                high, low = BYTE_LEVELS[i]
+                output_many(pins,high)
+                pulse()
+                output_many(pins,low)
+                pulse()
+                if not mode:
+                    exec_time = timing.command_time(i)
+                self._ready_at = now() + exec_time
+
+    def write(self,val,mode=1):
+        self.writeBytes((val & 0xff,),mode)
+
     def command(self,val):
         self.write(val,0)
 
     def clear(self):
         self.command(0b00000001)
-        delay(1500)
 
     def move(self,pos):
         self.command(0b10000000 | pos)
@@ -143,37 +222,75 @@ class Display(Component):
     def shift(self,direction):
         self.command(SHIFT_MASK | direction)
 
+    def encode(self,text):
+        # Text in the character ROM encoding, with any characters that need
+        # a CGRAM glyph pointed at the slot now holding it.
+        if isinstance(text,(bytes,bytearray)):
+            return text
+        data, glyphs = charset.encode(text)
+        if glyphs:
+            data = bytearray(data)
+            for pos, bitmap in glyphs:
+                data[pos] = ord(self.glyph(*bitmap))
+        return data
+
     def printString(self,s):
-        for i in s:
-            self.write(ord(i))
+        self.writeBytes(self.encode(s))
+
+    def flush(self):
+        pass
+
+    def _uploadChar(self,charbytes,index):
+        with self.lock:
+            self.command(0b01000000 + index * 8)
+            self.writeBytes(charbytes)
+            self.command(0b10000000)
+
+    # CGRAM residency: _glyphs maps each bitmap to the slot holding it, in
+    # least- to most-recently requested order.
+    def glyph(self,*bitmap):
+        bitmap = tuple(bitmap)
+        with self._glyph_lock:
+            if bitmap in self._glyphs:
+                self._glyphs.move_to_end(bitmap)
+                return chr(self._glyphs[bitmap])
+            used = set(self._glyphs.values())
+            free = [i for i in range(8) if i not in used]
+            if free:
+                index = free[0]
+            else:
+                index = self._glyphs.popitem(last=False)[1]
+            self._glyphs[bitmap] = index
+            self._uploadChar(bitmap,index)
+        return chr(index)
 
     def writeChar(self,*charbytes,index=None):
         if index is None:
-            index = self._next_custom_char
-            self._next_custom_char += 1
+            return self.glyph(*charbytes)
         if index > 7:
             raise ValueError("CGRAM can only contain 8 characters")
-        with self.lock:
-            self.command(0b01000000 + index * 8)
-            delay(50)
-            for i in charbytes:
-                self.write(i)
-            delay(50)
-            self.command(0b10000000)
+        with self._glyph_lock:
+            for bitmap, slot in list(self._glyphs.items()):
+                if slot == index:
+                    del self._glyphs[bitmap]
+            self._glyphs[tuple(charbytes)] = index
+            self._uploadChar(charbytes,index)
+        return chr(index)
 
     def init(self,bl=False):
         with self.lock:
             super().init(True)
+            self._glyphs.clear()
             
             self.__write4(0b0011) # Set to 8 bit mode
+            delay(timing.POWER_ON_TIME // 1000)
             self.__write4(0b0011) # Again, in case in 4 bit mode
+            delay(timing.INIT_TIME // 1000 + 1) # datasheet: more than 100us
             self.__write4(0b0010) # Set to 4 bit mode in 8 bit mode
 
             self.set_init()
 
-            delay(500)
             self.command(0b00101000) # Set to use max number of lines and font 0
-            delay(100)
             self.clear()
 
             self.lit = bl
@@ -192,11 +309,17 @@ class Display(Component):
 
 ROW_ADDENDS = {0: 0, 1: 64, 2: COLS, 3: 64+COLS}
 
+BLANK_ROW = b" " * COLS
+NEWLINE = charset.ROM["\n"]
+
 class ManagedDisplay(Display):
+    # Rows are kept as bytearrays in the character ROM encoding, so text is
+    # translated once when it is inserted and diffs compare raw bytes.
     def __init__(self,*args,**kwargs):
         super().__init__(*args,**kwargs)
-        self._contents = [[" " for j in range(COLS)] for i in range(ROWS)]
+        self._contents = [bytearray(BLANK_ROW) for i in range(ROWS)]
         self.insertion_lock = threading.RLock()
+        self._frames = threading.local()
         
     def move(self,row,col):
         if 0 > col > COLS-1:
@@ -206,48 +329,228 @@ class ManagedDisplay(Display):
         except KeyError as err:
             raise ValueError("Invalid row ({})".format(row))
 
-    def insert(self,row,col,contents,clear=False,wrap=False):
+    def clear(self):
+        if self._staging():
+            return self._stageClear()
+        with self.insertion_lock:
+            super().clear()
+            self._contents = [bytearray(BLANK_ROW) for i in range(ROWS)]
+
+    # Frames: inside "with display.frame():" inserts and clears made on the
+    # calling thread are staged as (cells, touched columns) per row, one
+    # dict per nesting level, and only the touched cells are committed when
+    # the outermost frame exits. Other threads keep drawing normally.
+    @contextlib.contextmanager
+    def frame(self):
+        stack = self._frames.__dict__.setdefault("stack", [])
+        stack.append({})
+        try:
+            yield self
+        except BaseException:
+            stack.pop()
+            raise
+        staged = stack.pop()
+        if stack:
+            outer = stack[-1]
+            for r, (cells, touched) in staged.items():
+                if r in outer:
+                    for c in touched:
+                        outer[r][0][c] = cells[c]
+                    outer[r][1].update(touched)
+                else:
+                    outer[r] = (cells, touched)
+            return
         with self.insertion_lock:
-            if clear:
-                self.clearRow(row)
-            self.move(row,col)
-            for i in contents:
-                if col > COLS-1 or i == "\n":
-                    if wrap:
-                        col = 0
-                        row += 1
-                        if row > ROWS-1:
-                            return False
-                        if clear:
-                            self.clearRow(row)
-                        self.move(row,col)
-                    else:
-                        return False
-                self.printString(i)
-                self._contents[row][col] = i
+            rows = {}
+            for r, (cells, touched) in staged.items():
+                if touched:
+                    rows[r] = bytearray(self._row(r))
+                    for c in touched:
+                        rows[r][c] = cells[c]
+            if rows:
+                self._commit(rows)
+
+    def _staging(self):
+        return bool(getattr(self._frames, "stack", None))
+
+    def _current(self,row):
+        # The row as the calling thread sees it, including staged changes
+        for level in reversed(getattr(self._frames, "stack", ())):
+            if row in level:
+                return level[row][0]
+        return self._row(row)
+
+    def _stage(self,rows,clear=False):
+        if not self._staging():
+            return self._commit(rows)
+        level = self._frames.stack[-1]
+        for r, cells in rows.items():
+            base = self._current(r)
+            touched = set(range(COLS)) if clear else \
+                {c for c in range(COLS) if cells[c] != base[c]}
+            if r in level:
+                touched |= level[r][1]
+            level[r] = (bytearray(cells), touched)
+
+    def _stageClear(self):
+        self._stage({r: bytearray(BLANK_ROW) for r in range(ROWS)},True)
+
+    def _compose(self,row,col,contents,clear=False,wrap=False):
+        # Lay contents out over copies of the affected rows without touching
+        # the bus; returns the new rows and whether everything fit.
+        rows = {}
+        def target(r):
+            if r not in rows:
+                rows[r] = bytearray(BLANK_ROW if clear else self._current(r))
+            return rows[r]
+        if row not in ROW_ADDENDS:
+            raise ValueError("Invalid row ({})".format(row))
+        target(row)
+        for i in self.encode(contents):
+            if col > COLS-1 or i == NEWLINE:
+                if wrap:
+                    col = 0
+                    row += 1
+                    if row > ROWS-1:
+                        return rows, False
+                    target(row)
+                    if i == NEWLINE:
+                        continue
+                else:
+                    return rows, False
+            target(row)[col] = i
+            col += 1
+        return rows, True
+
+    def _blit(self,row,cells):
+        # Transmit only the runs of cells that differ from the shadow buffer,
+        # relying on the address counter auto-incrementing within a run.
+        current = self._contents[row]
+        col = 0
+        while col < COLS:
+            if cells[col] == current[col]:
                 col += 1
-        return True
+                continue
+            start = col
+            while col < COLS and cells[col] != current[col]:
+                col += 1
+            self.move(row,start)
+            self.writeBytes(cells[start:col])
+            current[start:col] = cells[start:col]
+
+    def _row(self,row):
+        return self._contents[row]
+
+    def _commit(self,rows):
+        for r in sorted(rows):
+            self._blit(r,rows[r])
+        trace = latency.current()
+        if trace:
+            trace.drawn()
+
+    def insert(self,row,col,contents,clear=False,wrap=False):
+        with self.insertion_lock:
+            rows, complete = self._compose(row,col,contents,clear,wrap)
+            self._stage(rows,clear)
+        return complete
+
+    def insertRuns(self,row,runs):
+        # Place several (col, text) runs within one row in a single update
+        with self.insertion_lock:
+            cells = bytearray(self._current(row))
+            for col, text in runs:
+                data = self.encode(text)
+                cells[col:col+len(data)] = data
+            self._stage({row: cells[:COLS]})
 
     def clearRow(self,row):
-        self.insert(row,0," "*COLS,False,False)
+        self.insert(row,0,"",clear=True)
+
+    def snapshot(self):
+        # The rows as they are now, for restore() to bring back later
+        with self.insertion_lock:
+            return tuple(bytes(self._current(r)) for r in range(ROWS))
+
+    def restore(self,snapshot):
+        # Put a snapshot back, sending only the cells that differ
+        with self.insertion_lock:
+            self._stage({r: bytearray(row) for r, row in enumerate(snapshot)},
+                        True)
 
     def getRow(self,row):
-        return "".join(self._contents[row])
+        return charset.decode(self._current(row))
 
     def __str__(self):
-        return "\n".join(["".join(l) for l in self._contents])
+        return "\n".join([self.getRow(i) for i in range(ROWS)])
 
     def redisplay(self,row=None):
-        for i in range(row if row else 0, row+1 if row else ROWS):
-            self.insert(i,0,"".join(self._contents[i]),clear=True)
-
-
-class Done(Exception): pass
-
-def wait_with_event(wait,event):
-    for i in range(10):
-        if event.is_set(): raise Done("{} was set.".format(event))
-        time.sleep(wait/10)
+        # Resend rows verbatim, for when the glass may not match the shadow.
+        with self.insertion_lock:
+            for i in range(row if row else 0, row+1 if row else ROWS):
+                self.move(i,0)
+                self.writeBytes(self._contents[i])
+
+
+class TimerWheel:
+    # Hashed timing wheel driving the display animations. Items are filed in
+    # the slot for the tick (of resolution seconds) they are due at, so
+    # scheduling and expiring them does not depend on how many are pending.
+    def __init__(self,resolution=0.05,size=64):
+        self.resolution = resolution
+        self.slots = [[] for i in range(size)]
+        self.origin = time.monotonic()
+        self.tick = 0
+        self.count = 0
+
+    def schedule(self,when,item):
+        due = math.ceil((when - self.origin) / self.resolution)
+        due = max(due, self.tick + 1)
+        self.slots[due % len(self.slots)].append((due, item))
+        self.count += 1
+
+    def expire(self,now):
+        target = int((now - self.origin) / self.resolution)
+        ready = []
+        for t in range(max(self.tick + 1, target - len(self.slots) + 1),
+                       target + 1):
+            slot = self.slots[t % len(self.slots)]
+            if slot:
+                ready.extend(i for i in slot if i[0] <= target)
+                slot[:] = [i for i in slot if i[0] > target]
+        self.tick = max(self.tick, target)
+        self.count -= len(ready)
+        ready.sort(key=lambda i: i[0])
+        return [i[1] for i in ready]
+
+    def timeout(self,now):
+        # Seconds until the next item is due, or None if there are none
+        if not self.count:
+            return None
+        size = len(self.slots)
+        due = None
+        for t in range(self.tick + 1, self.tick + size + 1):
+            if any(i[0] == t for i in self.slots[t % size]):
+                due = t
+                break
+        if due is None:
+            due = min(i[0] for slot in self.slots for i in slot)
+        return max(self.origin + due * self.resolution - now, 0)
+
+MARQUEE_STEP = 3
+
+def diff_runs(old,new):
+    # [(col, text), ...] for the runs of cells that differ between two rows
+    runs = []
+    col = 0
+    while col < len(new):
+        if old[col] == new[col]:
+            col += 1
+            continue
+        start = col
+        while col < len(new) and old[col] != new[col]:
+            col += 1
+        runs.append((start, new[start:col]))
+    return runs
 
 class Row():
     def __init__(self,row):
@@ -256,6 +559,8 @@ class Row():
         self.original_contents = ""
         self.contents = ""
         self.pos = 0
+        self.frames = ()
+        self.deltas = ()
 
     def setContents(self,val,pad=True):
         self.original_contents = val
@@ -267,54 +572,238 @@ class Row():
         else:
             self.contents = val
         self.pos = 0
+        self.frames = ()
+        self.deltas = ()
+        if len(self.contents) > COLS:
+            # The marquee cycle, and for each frame only the cells that
+            # change on the way to the next one.
+            doubled = self.contents * 2
+            self.frames = tuple(doubled[i:i+COLS] for i in
+                                range(0, len(self.contents), MARQUEE_STEP))
+            self.deltas = tuple(
+                diff_runs(frame, self.frames[(n+1) % len(self.frames)])
+                for n, frame in enumerate(self.frames))
+
+MARQUEE_RATE = 0.5
+BLINK_RATE = 0.5
 
 class AnimatedDisplay(ManagedDisplay):
+    # All bus traffic happens on a single render thread: inserts only update
+    # the requested frame (_frame) and queue a flush, which diffs the latest
+    # frame against the glass, so superseded updates never reach the bus.
+    # Other output (backlight, mode changes, CGRAM) is queued in order.
+    #
+    # Animations are generators run on the same thread from a TimerWheel:
+    # each value one yields is the delay before it is resumed. With nothing
+    # animating the thread just blocks on the queue.
     def __init__(self,*args,**kwargs):
         super().__init__(*args,**kwargs)
         self.rows = [Row(i) for i in range(ROWS)]
-        self._loading_stopper = None
-        self._done_stopping_load = threading.Event()
         self.animation_lock = threading.RLock()
-        self.thread = None
+        self._animations = {}
+        self._wheel = TimerWheel()
+        self._frame = [bytearray(BLANK_ROW) for i in range(ROWS)]
+        self._commands = queue.Queue()
+        self._flush_pending = False
+        self._traces = []
+        self._renderer = None
+
+    def _submit(self,func,*args):
+        if (self._renderer is None or
+            threading.current_thread() is self._renderer):
+            with self.lock:
+                func(*args)
+        else:
+            self._commands.put((func, args))
+
+    def _render(self):
+        while True:
+            try:
+                func, args = self._commands.get(
+                    timeout=self._wheel.timeout(time.monotonic()))
+            except queue.Empty:
+                self._runAnimations()
+                continue
+            try:
+                if func is None:
+                    return
+                with self.lock:
+                    func(*args)
+            except Exception as err:
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                self._commands.task_done()
+            self._runAnimations()
+
+    def _runAnimations(self):
+        now = time.monotonic()
+        for entry in self._wheel.expire(now):
+            with self.animation_lock:
+                animation, key, when = entry
+                if animation is None:
+                    continue
+                try:
+                    delay = next(animation)
+                except Exception as err:
+                    if not isinstance(err, StopIteration):
+                        traceback.print_exc(file=sys.stderr)
+                    if self._animations.get(key) is entry:
+                        del self._animations[key]
+                    entry[0] = None
+                    continue
+            # Keep to the animation's own rate rather than drifting by the
+            # wheel resolution each step, unless it has fallen behind.
+            entry[2] = max(when + delay, now)
+            self._wheel.schedule(entry[2],entry)
+
+    def animate(self,key,animation):
+        # Run a generator as the animation called key, replacing any other
+        # animation with that key.
+        with self.animation_lock:
+            self.stopAnimation(key)
+            entry = [animation, key, time.monotonic()]
+            self._animations[key] = entry
+        self._submit(self._wheel.schedule,entry[2],entry)
+
+    def stopAnimation(self,key):
+        # Once this returns the animation will not touch the frame again.
+        with self.animation_lock:
+            entry = self._animations.pop(key,None)
+            if entry:
+                entry[0] = None
+            return entry is not None
+
+    def isAnimating(self,key):
+        return key in self._animations
+
+    def _flushFrame(self):
+        with self.insertion_lock:
+            self._flush_pending = False
+            frame = [bytes(i) for i in self._frame]
+            traces, self._traces = self._traces, []
+        for n, i in enumerate(frame):
+            self._blit(n,i)
+        for i in traces:
+            i.drawn()
+
+    def flush(self):
+        if (self._renderer is not None and
+            threading.current_thread() is not self._renderer):
+            self._commands.join()
+
+    def _row(self,row):
+        return self._frame[row]
+
+    def _commit(self,rows):
+        for r, cells in rows.items():
+            self._frame[r] = cells
+        trace = latency.current()
+        if trace:
+            self._traces.append(trace)
+        if not self._flush_pending:
+            self._flush_pending = True
+            self._submit(self._flushFrame)
+
+    def __clear(self):
+        super().clear()
+        self._flushFrame()
+
+    def clear(self):
+        if self._staging():
+            return self._stageClear()
+        with self.insertion_lock:
+            self._frame = [bytearray(BLANK_ROW) for i in range(ROWS)]
+            self._submit(self.__clear)
+
+    def redisplay(self,row=None):
+        self._submit(super().redisplay,row)
+
+    def _uploadChar(self,charbytes,index):
+        self._submit(super()._uploadChar,charbytes,index)
+
+    @property
+    def lit(self):
+        return ManagedDisplay.lit.fget(self)
+
+    @lit.setter
+    def lit(self,state):
+        self._submit(ManagedDisplay.lit.fset,self,state)
+
+    @property
+    def enabled(self):
+        return ManagedDisplay.enabled.fget(self)
+
+    @enabled.setter
+    def enabled(self,state):
+        self._submit(ManagedDisplay.enabled.fset,self,state)
+
+    @property
+    def cursor(self):
+        return ManagedDisplay.cursor.fget(self)
+
+    @cursor.setter
+    def cursor(self,state):
+        self._submit(ManagedDisplay.cursor.fset,self,state)
+
+    @property
+    def blink(self):
+        return ManagedDisplay.blink.fget(self)
+
+    @blink.setter
+    def blink(self,state):
+        self._submit(ManagedDisplay.blink.fset,self,state)
+
+    def init(self,*args,**kwargs):
+        # Stop the renderer before Display.init takes the lock; cleaning up
+        # from inside it would wait on a render thread blocked on that lock.
+        if self._checkInit(True) or self._renderer is not None:
+            self.cleanup()
+        super().init(*args,**kwargs)
+        self._renderer = threading.Thread(target=self._render,
+                                          name="DisplayRenderThread")
+        self._renderer.daemon = True
+        self._renderer.start()
+
+    def __loading(self,row):
+        while True:
+            self.insert(row,12,"   ")
+            yield 1
+            for i in range(12,15):
+                self.insert(row,i,".")
+                yield .5
+            yield .5
 
     def displayLoadingAnimation(self,row=1):
-        self.__load_error = False
-        if self._loading_stopper:
-            self._loading_stopper()
+        self.stopAnimation("loading")
         self.insert(row,5,"Loading",True)
-        event = threading.Event()
-        thread = threading.Thread(target=self.__displayLoadingAnimation,args=(row,event),
-                                  name="LoadingAnimationThread")
-        thread.daemon = True
-        self._loading_stopper = event.set
-        thread.start()
+        self.__loading_row = row
+        self.animate("loading",self.__loading(row))
 
     def stopLoadingAnimation(self,error=False):
-        self.__load_error = error
-        if self._loading_stopper:
-            self._loading_stopper()
-            self._done_stopping_load.wait()
-            self._done_stopping_load.clear()
-
-    def __displayLoadingAnimation(self,row,event):
-        try:
-            while True:
-                self.insert(row,12,"   ")
-                wait_with_event(1,event)
-                for i in range(12,15):
-                    self.insert(row,i,".")
-                    wait_with_event(.5,event)
-                wait_with_event(.5,event)
-        except Done:
-            try:
-                if self.__load_error:
-                    self.insert(row,7,"Error!",True)
-                else:
-                    self.insert(row,8,"Done",True)
-            except RuntimeError as err:
-                pass
-            self._loading_stopper = None
-            self._done_stopping_load.set()
+        if self.stopAnimation("loading"):
+            if error:
+                self.insert(self.__loading_row,7,"Error!",True)
+            else:
+                self.insert(self.__loading_row,8,"Done",True)
+
+    def __marquee(self,row):
+        i = self.rows[row]
+        i.pos = 0
+        self.insert(i.row,0,i.frames[0])
+        while True:
+            yield MARQUEE_RATE
+            self.insertRuns(i.row,i.deltas[i.pos])
+            i.pos = (i.pos + 1) % len(i.frames)
+
+    def __blink(self,row,content,count):
+        while count is None or count > 0:
+            self.insert(row,0,content,True)
+            yield BLINK_RATE
+            self.insert(row,0,"",True)
+            yield BLINK_RATE
+            if count is not None:
+                count -= 1
+        self.insert(row,0,content,True)
 
     def animateRow(self,row,content,clear=True):
         if self.rows[row].original_contents != content:
@@ -322,19 +811,24 @@ class AnimatedDisplay(ManagedDisplay):
             self.rows[row].setContents(content)
         if len(self.rows[row].contents) <= COLS:
             self.insert(row,0,self.rows[row].contents,clear)
+        elif not self.isAnimating(("row",row)):
+            self.animate(("row",row),self.__marquee(row))
         self.rows[row].enabled = True
-        if not self.thread or not self.thread.is_alive():
-            self.thread = threading.Thread(target=self._animateRows,name="RowAnimationThread")
-            self.thread.daemon = True
-            self.thread.start()
         return True
 
+    def blinkRow(self,row,content,count=None):
+        self.stopRow(row,skip_reprint=True)
+        self.rows[row].setContents(content)
+        self.rows[row].enabled = True
+        self.animate(("row",row),self.__blink(row,self.rows[row].contents,count))
+
     def stopRow(self,row,clear=False,skip_reprint=False):
-        if not self.rows[row].enabled:
-            return False
-        self.rows[row].enabled = False
-        if not skip_reprint:
-            with self.animation_lock:
+        with self.animation_lock:
+            self.stopAnimation(("row",row))
+            if not self.rows[row].enabled:
+                return False
+            self.rows[row].enabled = False
+            if not skip_reprint:
                 if clear:
                     self.insert(row,0,"",True)
                 else:
@@ -347,30 +841,18 @@ class AnimatedDisplay(ManagedDisplay):
             for i in rows:
                 self.stopRow(i,clear)
 
-    def _animateRows(self):
-        try:
-            while True:
-                with self.animation_lock:
-                    for i in self.rows:
-                        if len(i.contents) > COLS and i.enabled:
-                            part = i.contents[i.pos:min(i.pos+COLS,len(i.contents))]
-                            part += i.contents[:COLS-len(part)]
-                            self.insert(i.row,0,part)
-                            i.pos += 3
-                            if i.pos > len(i.contents):
-                                i.pos = i.pos % len(i.contents) - 1
-                time.sleep(0.5)
-        except BaseException as err:
-            print(repr(err))
-
     def cleanup(self,*args,**kwargs):
         if self._checkInit(True):
             try:
-                if self._loading_stopper:
-                    self._loading_stopper()
+                self.stopAnimation("loading")
                 self.stopRows(0,1,2,3,clear=True)
             except RuntimeError as err:
                 pass # print("Warning (RuntimeError):",err,file=sys.stderr)
+        if self._renderer is not None:
+            self.flush()
+            self._commands.put((None, ()))
+            self._renderer.join()
+            self._renderer = None
         super().cleanup(*args,**kwargs)
 
 if __name__ == "__main__":
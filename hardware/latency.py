@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+#
+# Input-to-glass latency tracing.
+#
+# Each button event carries the perf_counter_ns() time of its edge. The
+# Manager begins a Trace when it takes the event off its queue and stamps
+# it after Screen.input() and after any resulting screen change; displays
+# stamp the current trace once the writes it caused have reached the bus.
+# Per-stage histograms are kept in milliseconds:
+#
+#   manager  edge -> Manager picks the event up
+#   input    Screen.input()
+#   update   leaving/entering screens
+#   display  input handled -> last bus byte it caused
+#   total    edge -> last bus byte (or input handled, if nothing was drawn)
+#
+# install() dumps them to DUMP_PATH on SIGUSR1, followed by any reports
+# other modules have registered with add_report().
+#
+
+import os, sys, threading, signal
+
+try:
+    from . import timing
+except SystemError:
+    import timing
+
+STAGES = ("manager", "input", "update", "display", "total")
+
+BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+DUMP_PATH = os.path.expanduser("~/.homectrl/latency.txt")
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self,ms):
+        for n, limit in enumerate(BUCKETS):
+            if ms <= limit:
+                break
+        else:
+            n = len(BUCKETS)
+        self.counts[n] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self,fraction):
+        # Upper bound of the bucket holding that fraction of samples
+        seen = 0
+        for n, count in enumerate(self.counts):
+            seen += count
+            if seen >= fraction * self.count:
+                return BUCKETS[n] if n < len(BUCKETS) else self.max
+        return 0
+
+    def format(self):
+        if not self.count:
+            return "no samples"
+        return "n={} mean={:.1f} p50<={} p95<={} max={:.1f} ms".format(
+            self.count, self.total / self.count, self.percentile(.5),
+            self.percentile(.95), self.max)
+
+histograms = {i: Histogram() for i in STAGES}
+_lock = threading.Lock()
+_local = threading.local()
+_last = None
+_reports = []
+
+def record(stage,ns):
+    with _lock:
+        histograms[stage].add(ns / 1e6)
+
+class Trace:
+    def __init__(self,edge):
+        self.edge = edge
+        self.last = edge
+        self.done = None
+        self.glass = None
+        self.finished = False
+
+    def stamp(self,stage):
+        now = timing.now()
+        record(stage,now - self.last)
+        self.last = now
+
+    def drawn(self):
+        # Called by displays, possibly from their render thread
+        self.glass = timing.now()
+
+    def finish(self):
+        if self.finished or self.done is None:
+            return
+        self.finished = True
+        glass = self.glass
+        if glass is not None:
+            record("display",max(glass - self.done, 0))
+            record("total",glass - self.edge)
+        else:
+            record("total",self.done - self.edge)
+
+def begin(event):
+    # Start tracing an input event on the calling thread, finishing the
+    # previous trace (whose last flush has long since happened).
+    global _last
+    edge = getattr(event, "timestamp", None)
+    if _last is not None:
+        _last.finish()
+    if edge is None:
+        _local.trace = _last = None
+        return None
+    _local.trace = _last = Trace(edge)
+    _last.stamp("manager")
+    return _last
+
+def end(trace):
+    if trace is not None:
+        trace.done = trace.last
+    _local.trace = None
+
+def current():
+    # The trace for the input being handled on this thread, if any
+    return getattr(_local, "trace", None)
+
+def add_report(title,report):
+    # report() returns text to include in every dump
+    _reports.append((title, report))
+
+def dump(out=sys.stderr):
+    last = _last
+    if last is not None and last.done is not None and \
+       timing.now() - last.done > 1e9:
+        last.finish()
+    with _lock:
+        for stage in STAGES:
+            print("{:8} {}".format(stage, histograms[stage].format()),
+                  file=out)
+        limits = ["<={}".format(i) for i in BUCKETS] + [">"+str(BUCKETS[-1])]
+        print("{:8} {}".format("ms", " ".join("{:>6}".format(i)
+                                              for i in limits)), file=out)
+        for stage in STAGES:
+            print("{:8} {}".format(stage, " ".join(
+                "{:>6}".format(i) for i in histograms[stage].counts)),
+                  file=out)
+    for title, report in _reports:
+        print("\n" + title, file=out)
+        try:
+            print(report(), file=out)
+        except Exception as err:
+            print(repr(err), file=out)
+
+def dump_file(path=DUMP_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as out:
+        dump(out)
+
+def install(signum=signal.SIGUSR1,path=DUMP_PATH):
+    # The handler runs on the main thread, which may be inside record()
+    # holding _lock, so the dump is written from a thread of its own.
+    def handler(*args):
+        thread = threading.Thread(target=dump_file, args=(path,),
+                                  name="LatencyDumpThread")
+        thread.daemon = True
+        thread.start()
+    signal.signal(signum, handler)
@@ -6,63 +6,199 @@
 # C D1: RXD
 # D D0: TXD
 #
+# The receiver holds an output high for as long as its button is held.
+# Both edges are timestamped as they arrive and handed to an input thread,
+# which debounces them and turns them into ButtonEvents: a PRESS on the
+# leading edge, one LONG_PRESS once the button has been held for
+# long_press seconds, and REPEATs from repeat_delay onwards, each
+# acceleration times closer together down to repeat_min.
+#
 
-import RPi.GPIO as gpio
+import threading, queue
 from time import sleep
 from collections import defaultdict
 
 try:
     from .component import Component
+    from .bus import BOTH
+    from . import timing
 except SystemError:
     from component import Component
+    from bus import BOTH
+    import timing
 
 A = 8  # TXD
 B = 10 # RXD
 C = 24 # CE0
 D = 26 # CE1
 
+PRESS = "press"
+LONG_PRESS = "long press"
+REPEAT = "repeat"
+EVENTS = (PRESS, LONG_PRESS, REPEAT)
+
+DEBOUNCE = 0.03
+LONG_PRESS_TIME = 0.8
+REPEAT_DELAY = 0.4
+REPEAT_INTERVAL = 0.2
+REPEAT_MIN = 0.04
+REPEAT_ACCELERATION = 0.8
+
+class ButtonEvent(int):
+    # Compares equal to the button number, so handlers that only care which
+    # button it was can keep treating it as one.
+    def __new__(cls,button,kind=PRESS,timestamp=None,count=0):
+        self = super().__new__(cls,button)
+        self.kind = kind
+        self.timestamp = timing.now() if timestamp is None else timestamp
+        self.count = count
+        return self
+
+    def __repr__(self):
+        return "ButtonEvent({}, {!r}, count={})".format(
+            int(self), self.kind, self.count)
+
+def _ns(seconds):
+    return int(seconds * 1e9)
+
+class _Button:
+    def __init__(self):
+        self.held = False
+        self.settles = None # end of the debounce window, if any
+        self.long_at = None
+        self.repeat_at = None
+        self.interval = 0
+        self.count = 0
+
 class RFReceiver(Component):
-    def __init__(self,a=A,b=B,c=C,d=D):
+    def __init__(self,a=A,b=B,c=C,d=D,bus=None,debounce=DEBOUNCE,
+                 long_press=LONG_PRESS_TIME,repeat_delay=REPEAT_DELAY,
+                 repeat_interval=REPEAT_INTERVAL,repeat_min=REPEAT_MIN,
+                 acceleration=REPEAT_ACCELERATION):
         self.pins = (a, b, c, d)
         self.handlers = defaultdict(dict)
+        self.debounce = debounce
+        self.long_press = long_press
+        self.repeat_delay = repeat_delay
+        self.repeat_interval = repeat_interval
+        self.repeat_min = repeat_min
+        self.acceleration = acceleration
         self.__next_id = -1
-        super().__init__(inpins=self.pins)
+        self.__edges = queue.Queue()
+        self.__buttons = [_Button() for i in self.pins]
+        self.__thread = None
+        super().__init__(inpins=self.pins,bus=bus)
 
     def init(self):
         super().init()
+        self.__buttons = [_Button() for i in self.pins]
+        self.__thread = threading.Thread(target=self.__run,
+                                         name="RFInputThread")
+        self.__thread.daemon = True
+        self.__thread.start()
         for n, i in enumerate(self.pins):
-            gpio.add_event_detect(i, gpio.RISING, bouncetime=500,
-                                  callback=lambda x,n=n: self._handle_pin(n))
+            self.bus.add_event_detect(i, lambda x,n=n: self._edge(n), BOTH)
 
     def cleanup(self):
         for i in self.pins:
-            gpio.remove_event_detect(i)
+            self.bus.remove_event_detect(i)
+        if self.__thread is not None:
+            self.__edges.put(None)
+            self.__thread.join()
+            self.__thread = None
         super().cleanup()
 
-    def _handle_pin(self,pin):
-        for i in self.handlers["generic"].values():
-            i(pin)
-        for i in self.handlers[pin].values():
-            i(pin)
+    def _edge(self,button):
+        # Called from the edge detection thread; keep it short.
+        now = timing.now()
+        self.__edges.put((button, self.bus.input(self.pins[button]), now))
+
+    def __run(self):
+        while True:
+            deadline = self.__deadline()
+            timeout = None if deadline is None else \
+                max(deadline - timing.now(), 0) / 1e9
+            try:
+                edge = self.__edges.get(timeout=timeout)
+            except queue.Empty:
+                edge = ()
+            if edge is None:
+                return
+            if edge:
+                self.__level(*edge)
+            self.__expire(timing.now())
+
+    def __deadline(self):
+        deadlines = [t for b in self.__buttons
+                     for t in (b.settles, b.long_at, b.repeat_at)
+                     if t is not None]
+        return min(deadlines) if deadlines else None
+
+    def __level(self,button,level,now):
+        state = self.__buttons[button]
+        level = bool(level)
+        if state.settles is not None and now < state.settles:
+            return # bounce; the level is checked again once it settles
+        if level == state.held:
+            return
+        state.held = level
+        state.settles = now + _ns(self.debounce)
+        if level:
+            state.count = 0
+            state.long_at = now + _ns(self.long_press)
+            state.repeat_at = now + _ns(self.repeat_delay)
+            state.interval = _ns(self.repeat_interval)
+            self._handle_pin(ButtonEvent(button,PRESS,now))
+        else:
+            state.long_at = state.repeat_at = None
+
+    def __expire(self,now):
+        for button, state in enumerate(self.__buttons):
+            if state.settles is not None and now >= state.settles:
+                state.settles = None
+                # Catch an edge that was swallowed by the debounce window
+                self.__level(button,self.bus.input(self.pins[button]),now)
+            if state.long_at is not None and now >= state.long_at:
+                state.long_at = None
+                self._handle_pin(ButtonEvent(button,LONG_PRESS,now))
+            if state.repeat_at is not None and now >= state.repeat_at:
+                state.count += 1
+                self._handle_pin(
+                    ButtonEvent(button,REPEAT,now,state.count))
+                state.interval = max(int(state.interval * self.acceleration),
+                                     _ns(self.repeat_min))
+                state.repeat_at = max(state.repeat_at + state.interval, now)
+
+    def _handle_pin(self,event):
+        if not isinstance(event,ButtonEvent):
+            event = ButtonEvent(event)
+        for callback, events in list(self.handlers["generic"].values()):
+            if event.kind in events:
+                callback(event)
+        for callback, events in list(self.handlers[int(event)].values()):
+            if event.kind in events:
+                callback(event)
 
     def __get_handlers(self,pin=None,generic=False):
         if (pin is None) and (not generic):
             raise TypeError("Must supply pin for non generic handler!")
         return self.handlers["generic"] if generic else self.handlers[pin]
 
-    def add_handler(self,callback,pin=None,generic=False):
+    def add_handler(self,callback,pin=None,generic=False,events=(PRESS,)):
+        # events lists the kinds of ButtonEvent the callback wants; by
+        # default it only sees presses.
         self.__next_id += 1
-        self.__get_handlers(pin,generic)[self.__next_id] = callback
+        self.__get_handlers(pin,generic)[self.__next_id] = (callback, events)
         return self.__next_id
 
     def remove_handler(self,hid,pin=None,generic=False):
         del self.__get_handlers(pin,generic)[hid]
 
 if __name__ == "__main__":
-    def echo(pin):
-        print("Press on button:", pin)
+    def echo(event):
+        print("Button {}: {}".format(int(event), event.kind))
     rf = RFReceiver()
-    rf.add_handler(echo,generic=True)
+    rf.add_handler(echo,generic=True,events=EVENTS)
     with rf:
         while True:
             sleep(1)
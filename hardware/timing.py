@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+#
+# Sub-millisecond waits for bit-banged buses.
+#
+# time.sleep() rounds anything short up to the scheduler's wakeup latency
+# (typically 60-100+ us on a Pi), which is longer than most HD44780
+# instructions take. Short waits here spin on perf_counter_ns() instead,
+# and long ones sleep for all but the measured oversleep and spin the rest.
+#
+
+import time
+
+# HD44780U datasheet timings (fosc = 270kHz), in nanoseconds.
+ENABLE_PULSE = 450
+EXEC_TIME = 37000
+DATA_EXEC_TIME = 41000 # 37us + 4us address counter update
+LONG_EXEC_TIME = 1520000 # clear display / return home
+POWER_ON_TIME = 4100000
+INIT_TIME = 100000 # between the second and third init nibbles
+
+now = time.perf_counter_ns
+
+_sleep_slack = None
+
+def calibrate(samples=5,request=100000):
+    # Measure how far past its deadline a short sleep actually wakes up.
+    global _sleep_slack
+    worst = 0
+    for i in range(samples):
+        start = now()
+        time.sleep(request/1e9)
+        worst = max(worst, now() - start - request)
+    _sleep_slack = worst + request // 2
+    return _sleep_slack
+
+def sleep_slack():
+    if _sleep_slack is None:
+        calibrate()
+    return _sleep_slack
+
+def wait_until(deadline):
+    remaining = deadline - now()
+    if remaining <= 0:
+        return
+    if remaining > 2 * sleep_slack():
+        time.sleep((remaining - _sleep_slack)/1e9)
+    while now() < deadline:
+        pass
+
+def wait_ns(nanoseconds):
+    wait_until(now() + nanoseconds)
+
+def command_time(value):
+    # Clear display (0x01) and return home (0x02/0x03) are the slow ones.
+    return LONG_EXEC_TIME if 0 < value < 4 else EXEC_TIME
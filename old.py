@@ -91,7 +91,7 @@ class HomeCtrl:
         elif ch == 3:
             vol -= 5
         self.player.volume = vol
-        self.display.insert(3,0,"Vol " + "\xff"*round(vol/6) + " "*(16-round(vol/6)))
+        self.display.insert(3,0,"Vol " + "█"*round(vol/6) + " "*(16-round(vol/6)))
 
         if getattr(self,"volume_timer",None):
             self.volume_timer.cancel()
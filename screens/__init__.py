@@ -1,5 +1,9 @@
 
-import queue, time
+import queue, time, heapq, threading, random, collections, sys, traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from hardware.rf import PRESS, REPEAT, EVENTS
+from hardware import latency
 
 A = SELECT = OK = 0
 B = PREV = UP   = 1
@@ -14,39 +18,164 @@ class Manager:
 
         self.events = queue.Queue()
         self.screens = []
+        self.timers = []
+        self.__timer_seq = 0
+        self.__timer_lock = threading.Lock()
+        self.__tick_timer = None
+        self.__thread = None
         
-        self.rf.add_handler(self.events.put, generic=True)
+        self.rf.add_handler(self.events.put, generic=True, events=EVENTS)
 
     @property
     def screen(self):
         return (self.screens or None) and self.screens[-1]
         
+    # Timers are (deadline, sequence, callback) lists on a heap, deadlines
+    # on the time.monotonic() clock. Cancelling clears the callback and the
+    # entry is dropped when it reaches the top.
+    def call_at(self, when, callback):
+        with self.__timer_lock:
+            self.__timer_seq += 1
+            timer = [when, self.__timer_seq, callback]
+            heapq.heappush(self.timers, timer)
+        if threading.current_thread() is not self.__thread:
+            self.events.put(None) # wake the loop to pick up the deadline
+        return timer
+
+    def call_later(self, delay, callback):
+        return self.call_at(time.monotonic() + delay, callback)
+
+    def cancel(self, timer):
+        if timer:
+            timer[2] = None
+
+    def post(self, callback):
+        self.events.put(callback)
+
+    def _run_timers(self):
+        while True:
+            with self.__timer_lock:
+                while self.timers and self.timers[0][2] is None:
+                    heapq.heappop(self.timers)
+                if not self.timers:
+                    return None
+                timeout = self.timers[0][0] - time.monotonic()
+                if timeout > 0:
+                    return timeout
+                callback = heapq.heappop(self.timers)[2]
+            callback()
+
+    def _tick(self):
+        self.__tick_timer = None
+        self.update(self.screen.tick())
+        self._schedule_tick()
+
+    def _schedule_tick(self):
+        self.cancel(self.__tick_timer)
+        self.__tick_timer = None
+        delay = self.screen and self.screen.next_tick()
+        if delay is not None:
+            self.__tick_timer = self.call_later(max(delay, 0), self._tick)
+
+    def _dispatch(self, event):
+        if event is None:
+            return
+        if callable(event):
+            event()
+        else:
+            trace = latency.begin(event)
+            ns = self.screen.input(event)
+            trace and trace.stamp("input")
+            self.update(ns)
+            trace and trace.stamp("update")
+            latency.end(trace)
+        self._schedule_tick()
+        
     def launch(self, screen):
         assert len(self.screens) == 0
+        self.__thread = threading.current_thread()
         with self.display, self.rf:
             self.update(screen)
             while self.screen:
-                self.update(self.screen.tick())
+                timeout = self._run_timers()
+                if not self.screen:
+                    break
                 try:
-                    while self.screen:
-                        pin = self.events.get_nowait()
-                        self.update(self.screen.input(pin))
+                    event = self.events.get(timeout=timeout)
                 except queue.Empty:
-                    pass
-                time.sleep(0.05)
+                    continue
+                self._dispatch(event)
 
     def update(self, ns):
+        # Pushing a screen suspends the one below it, and popping resumes
+        # it, so screens can come back without rebuilding themselves.
         if ns != self.screen:
-            self.screen and self.screen.exit()
             if ns is None:
+                self.screen.exit()
                 self.screens.pop()
+                self.screen and self.screen.resume()
             else:
+                self.screen and self.screen.suspend()
+                ns.manager = self
                 self.screens.append(ns)
-            self.screen and self.screen.enter()
+                ns.enter()
+            self._schedule_tick()
+
+class RetryPolicy:
+    # Exponential backoff with jitter for a screen's periodic work: after
+    # each consecutive failure the next attempt waits twice as long (up to
+    # limit), randomised by +/- jitter so flapping speakers are not all
+    # retried in step.
+    def __init__(self, base=1, limit=60, factor=2, jitter=0.25):
+        self.base = base
+        self.limit = limit
+        self.factor = factor
+        self.jitter = jitter
+        self.failures = 0
+        self.retry_at = None
+
+    def failed(self):
+        # Returns the delay before the next attempt
+        self.failures += 1
+        delay = min(self.base * self.factor ** (self.failures - 1),
+                    self.limit)
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.retry_at = time.monotonic() + delay
+        return delay
+
+    def succeeded(self):
+        # Returns whether this ended a run of failures
+        recovered = bool(self.failures)
+        self.failures = 0
+        self.retry_at = None
+        return recovered
+
+    def remaining(self):
+        if self.retry_at is None:
+            return 0
+        return max(self.retry_at - time.monotonic(), 0)
+
+    def ready(self):
+        return not self.remaining()
+
+class ScreenFactory:
+    # A menu option standing in for a screen that is only built, with
+    # factory(*args, **kwargs), when it is first selected.
+    def __init__(self, factory, *args, **kwargs):
+        self.factory = factory
+        self.args = args
+        self.kwargs = kwargs
+        self.screen = None
+
+    def __call__(self):
+        if self.screen is None:
+            self.screen = self.factory(*self.args, **self.kwargs)
+        return self.screen
 
 class Screen:
     def __init__(self, dis):
         self.__display = dis
+        self.manager = None
 
     @property
     def display(self):
@@ -55,6 +184,11 @@ class Screen:
     def tick(self):
         return self
 
+    def next_tick(self):
+        # Seconds until tick() should next run, or None to only wake up
+        # for input.
+        return None
+
     def input(self, button):
         return self
 
@@ -63,8 +197,21 @@ class Screen:
 
     def exit(self):
         self.display.enabled = False
+
+    def suspend(self):
+        # Another screen is being pushed on top of this one
+        self.exit()
+
+    def resume(self):
+        # The screen on top of this one has been popped
+        self.enter()
     
 class Menu(Screen):
+    # A menu keeps its options and cursor while another screen is on top of
+    # it, and snapshots its rows when an option is selected; resuming puts
+    # the snapshot back with a diff and then calls revalidate().
+    __snapshot = None
+
     def get_options(self):
         return {}
 
@@ -80,24 +227,49 @@ class Menu(Screen):
         self.__selected = 0
         self.__displayed = 0
 
+    def update_options(self, options=None):
+        # Swap in a new set of options while the menu is up, keeping the
+        # cursor on the same entry if it is still there.
+        if options is None:
+            options = self.get_options()
+        current = self.__keys[self.__selected] if self.__keys else None
+        self.__options = options
+        self.__keys = self.get_keys(options)
+        if current in self.__keys:
+            self.__selected = self.__keys.index(current)
+        else:
+            self.__selected = max(min(self.__selected, len(self.__keys)-1), 0)
+        self.__displayed = self.__selected
+        with self.display.frame():
+            self.draw_items()
+            self.draw_cursor()
+
     def input(self, button):
+        # Held arrows scroll; other buttons only act on the initial press.
+        kind = getattr(button, "kind", PRESS)
+        if kind != PRESS and not (kind == REPEAT and button in ARROWS):
+            return self
         if button in ARROWS:
             self.__selected += 1 if button == DOWN else -1
             self.__selected = self.__selected % len(self.__keys)
-            if (self.__selected // 4) != (self.__displayed // 4):
-                self.draw_items()
-            if self.__selected != self.__displayed:
-                self.draw_cursor()
+            with self.display.frame():
+                if (self.__selected // 4) != (self.__displayed // 4):
+                    self.draw_items()
+                if self.__selected != self.__displayed:
+                    self.draw_cursor()
         elif button == SELECT:
-            for i in range(4):
-                if self.__selected % 4 != i:
-                    self.display.clearRow(i)
-            #time.sleep(0.5)
-            ns = self.selected(
-                self.__options[self.__keys[self.__selected]])
-            if ns == self:
-                self.draw_items()
-                self.draw_cursor()
+            self.__snapshot = self.display.snapshot()
+            with self.display.frame():
+                for i in range(4):
+                    if self.__selected % 4 != i:
+                        self.display.clearRow(i)
+                option = self.__options[self.__keys[self.__selected]]
+                if isinstance(option, ScreenFactory):
+                    option = option()
+                ns = self.selected(option)
+                if ns == self:
+                    self.draw_items()
+                    self.draw_cursor()
             return ns
         elif button == BACK:
             return None
@@ -105,10 +277,25 @@ class Menu(Screen):
 
     def enter(self):
         super().enter()
+        self.__snapshot = None
         self.make_menu()
         self.draw_items()
         self.draw_cursor()
 
+    def resume(self):
+        if self.__snapshot is None:
+            return self.enter()
+        Screen.enter(self)
+        self.display.restore(self.__snapshot)
+        self.__snapshot = None
+        self.revalidate()
+
+    def revalidate(self):
+        # Called after resuming with the previous options; menus whose
+        # options can change should refresh them here without blocking and
+        # pass them to update_options().
+        pass
+
     def draw_items(self):
         index = (self.__selected // 4) * 4
         for i in range(4):
@@ -121,5 +308,182 @@ class Menu(Screen):
         self.display.insert(self.__displayed % 4, 0, "  ")
         self.display.insert(self.__selected % 4, 0, "> ")
         self.__displayed = self.__selected
-            
-            
+
+
+PAGE_SIZE = 4
+CACHED_PAGES = 32
+
+class PageCache:
+    # The pages of one source a PagedMenu has read, most recently used
+    # last, and the total length of the list. clear() bumps the generation
+    # so that fetches already in flight are dropped.
+    def __init__(self, size=CACHED_PAGES):
+        self.size = size
+        self.pages = collections.OrderedDict()
+        self.total = None
+        self.generation = 0
+
+    def clear(self):
+        self.generation += 1
+        self.pages.clear()
+
+class PagedMenu(Screen):
+    # A menu over a list too long to hold, read a page (one screenful) at a
+    # time from a source with fetch(start, count), which returns a list of
+    # (label, value) items and the total length of the list. Pages are
+    # fetched on a background thread, the one on screen first and then its
+    # neighbours, and the CACHED_PAGES most recently used are kept in a
+    # PageCache. By default that is emptied on every entry; subclasses can
+    # return a longer-lived one from get_cache() and invalidate() it when
+    # they learn the list has changed. A source that takes a while to find
+    # can be given later with set_source(); until then, and for entries
+    # that have not arrived yet, rows are drawn as "...".
+    def __init__(self, dis, source=None, cached_pages=CACHED_PAGES):
+        super().__init__(dis)
+        self.source = source
+        self.cached_pages = cached_pages
+        self.cache = None
+        self.cursor = 0
+        self.__pending = set()
+        self.__executor = None
+
+    def get_source(self):
+        return self.source
+
+    def get_cache(self):
+        return PageCache(self.cached_pages)
+
+    @property
+    def total(self):
+        return self.cache.total if self.cache else None
+
+    def selected(self, index, value):
+        return self
+
+    def label(self, index, label):
+        return label
+
+    def item(self, index):
+        # (label, value) at index, or None if its page is not loaded
+        page = self.cache.pages.get(index // PAGE_SIZE)
+        if page is None or index % PAGE_SIZE >= len(page):
+            return None
+        return page[index % PAGE_SIZE]
+
+    def enter(self):
+        super().enter()
+        self.cursor = 0
+        self.set_source(self.get_source())
+
+    def set_source(self, source):
+        self.source = source
+        self.cache = self.get_cache()
+        self.__pending.clear()
+        self.draw()
+
+    def resume(self):
+        Screen.enter(self)
+        self.draw()
+
+    def exit(self):
+        if self.__executor:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+        super().exit()
+
+    def invalidate(self):
+        # Forget every page (results still in flight are dropped) and fetch
+        # the visible one again.
+        self.cache.clear()
+        self.__pending.clear()
+        self.draw()
+
+    def input(self, button):
+        kind = getattr(button, "kind", PRESS)
+        if kind != PRESS and not (kind == REPEAT and button in ARROWS):
+            return self
+        if button in ARROWS:
+            if self.total:
+                self.cursor += 1 if button == DOWN else -1
+                self.cursor %= self.total
+                self.draw()
+        elif button == SELECT:
+            item = self.item(self.cursor)
+            if item is not None:
+                return self.selected(self.cursor, item[1])
+        elif button == BACK:
+            return None
+        return self
+
+    def draw(self):
+        page = self.cursor // PAGE_SIZE
+        self.__request(page)
+        if self.total:
+            self.__request((page + 1) % self.__page_count())
+            self.__request((page - 1) % self.__page_count())
+        with self.display.frame():
+            for row in range(PAGE_SIZE):
+                index = page * PAGE_SIZE + row
+                if self.total == 0 and row == 0:
+                    self.display.insert(row, 2, "Empty", clear=True)
+                elif self.total is not None and index >= self.total:
+                    self.display.clearRow(row)
+                else:
+                    item = self.item(index)
+                    text = "..." if item is None else self.label(index,
+                                                                 item[0])
+                    self.display.insert(row, 2, text, clear=True)
+            self.display.insert(self.cursor % PAGE_SIZE, 0, "> ")
+
+    def __page_count(self):
+        return max(-(-self.total // PAGE_SIZE), 1)
+
+    def __request(self, page):
+        if self.source is None:
+            return
+        if page in self.cache.pages:
+            self.cache.pages.move_to_end(page)
+            return
+        if page in self.__pending:
+            return
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="PagedMenuFetch")
+        self.__pending.add(page)
+        self.__executor.submit(self.__fetch, page, self.cache,
+                               self.cache.generation)
+
+    def __fetch(self, page, cache, generation):
+        # Runs on the fetch thread
+        try:
+            items, total = self.source.fetch(page * PAGE_SIZE, PAGE_SIZE)
+        except Exception as err:
+            traceback.print_exc(file=sys.stderr)
+            items, total = None, None
+        self.manager.post(
+            lambda: self.__loaded(page, cache, generation, items, total))
+
+    def __loaded(self, page, cache, generation, items, total):
+        # The page is kept even if the menu has been left since, as long
+        # as the cache has not been cleared.
+        if generation != cache.generation:
+            return
+        current = cache is self.cache
+        if current:
+            self.__pending.discard(page)
+        if items is None:
+            return # fetched again the next time it is drawn
+        cache.pages[page] = list(items)
+        while len(cache.pages) > cache.size:
+            cache.pages.popitem(last=False)
+        resized = total is not None and total != cache.total
+        if resized:
+            cache.total = total
+        if not current:
+            return
+        if resized:
+            self.cursor = max(min(self.cursor, self.total - 1), 0)
+        visible = page == self.cursor // PAGE_SIZE
+        if self.manager.screen is self and (visible or resized):
+            self.draw()
+
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+#
+# A stand-in Sonos speaker for exercising the screens without one.
+#
+#   python3 -m screens.simulated        # event -> display check
+#
+# SimulatedService hands out subscriptions shaped like soco's (an events
+# queue, is_subscribed, time_left, unsubscribe()) and send() pushes UPnP
+# event variables to every live one, as a speaker's NOTIFY requests would
+# once soco has parsed them. SimulatedPlayer answers the SoCo calls the
+# screens make and sends the events a real speaker would for each change,
+# so EventSubscription, NowPlaying.transport_event/rendering_event and
+# QueueBrowser can be driven end to end on a SimulatedHardware display.
+#
+
+import queue, sys, threading, time, types
+
+from hardware import AnimatedDisplay, RFReceiver, SimulatedHardware
+from . import Manager, UP, BACK
+from . import sonos
+
+class SimulatedQueue(list):
+    # What get_queue() returns: a page of items and the queue length
+    total_matches = 0
+
+class SimulatedSubscription:
+    def __init__(self, service, timeout=300):
+        self.service = service
+        self.events = queue.Queue()
+        self.is_subscribed = True
+        self.expires = time.time() + timeout
+
+    @property
+    def time_left(self):
+        return max(self.expires - time.time(), 0) if self.is_subscribed \
+            else 0
+
+    def unsubscribe(self):
+        self.service.drop(self)
+
+class SimulatedService:
+    # One UPnP event service. Like a speaker's, it sends each new
+    # subscription an event with the current state, from initial(). With
+    # fail set, subscribing raises as it does when the speaker cannot reach
+    # our event listener; lapse() expires every subscription, as a missed
+    # renewal would.
+    def __init__(self, service_type, initial=dict):
+        self.service_type = service_type
+        self.initial = initial
+        self.subscriptions = []
+        self.fail = False
+        self.__lock = threading.Lock()
+
+    def subscribe(self, auto_renew=False):
+        if self.fail:
+            raise OSError("{}: subscription refused".format(
+                self.service_type))
+        sub = SimulatedSubscription(self)
+        sub.events.put(types.SimpleNamespace(service=self,
+                                             variables=self.initial()))
+        with self.__lock:
+            self.subscriptions.append(sub)
+        return sub
+
+    def drop(self, sub):
+        with self.__lock:
+            sub.is_subscribed = False
+            if sub in self.subscriptions:
+                self.subscriptions.remove(sub)
+
+    def lapse(self):
+        with self.__lock:
+            subs, self.subscriptions = self.subscriptions, []
+        for i in subs:
+            i.is_subscribed = False
+
+    def send(self, **variables):
+        with self.__lock:
+            subs = list(self.subscriptions)
+        for i in subs:
+            i.events.put(types.SimpleNamespace(
+                service=self, variables=dict(variables)))
+        return len(subs)
+
+class SimulatedPlayer:
+    # A speaker that is its own group coordinator, with a queue of numbered
+    # tracks. Every SoCo call made is appended to calls.
+    def __init__(self, ip="127.0.0.1", name="Simulated", tracks=100):
+        self.ip_address = ip
+        self.player_name = name
+        self.uid = "RINCON_SIM{}".format(ip.replace(".", ""))
+        self.avTransport = SimulatedService("AVTransport", lambda: {
+            "transport_state": self.state,
+            "current_track": str(self.track + 1),
+            "current_track_duration": "0:03:00",
+            "current_track_meta_data": self.metadata()})
+        self.renderingControl = SimulatedService("RenderingControl",
+            lambda: {"volume": {"Master": str(self._volume)}})
+        self.contentDirectory = SimulatedService("ContentDirectory",
+            lambda: {"container_update_i_ds": "Q:0,{}".format(
+                self.queue_id)})
+        self.zoneGroupTopology = SimulatedService("ZoneGroupTopology",
+            lambda: {"zone_group_state": self.uid})
+        self.calls = []
+        self.state = sonos.STOPPED
+        self.queue = ["Track {}".format(i + 1) for i in range(tracks)]
+        self.queue_id = 1
+        self.track = 0
+        self.started = time.monotonic()
+        self._volume = 20
+
+    @property
+    def group(self):
+        self.calls.append("group")
+        return types.SimpleNamespace(coordinator=self, members={self})
+
+    @property
+    def volume(self):
+        self.calls.append("volume")
+        return self._volume
+
+    @volume.setter
+    def volume(self, volume):
+        self.calls.append(("volume", volume))
+        self.set_volume(volume)
+
+    def metadata(self):
+        title = self.queue[self.track] if self.queue else ""
+        return types.SimpleNamespace(title=title, creator="Simulated Artist",
+                                     album="Simulated Album")
+
+    def get_current_track_info(self):
+        self.calls.append("get_current_track_info")
+        meta = self.metadata()
+        position = 0
+        if self.state == sonos.PLAYING:
+            position = int(time.monotonic() - self.started)
+        return {"title": meta.title, "artist": meta.creator,
+                "album": meta.album, "duration": "0:03:00",
+                "position": sonos.format_time(position)}
+
+    def get_current_transport_info(self):
+        self.calls.append("get_current_transport_info")
+        return {"current_transport_state": self.state}
+
+    def play(self):
+        self.calls.append("play")
+        self.set_state(sonos.PLAYING)
+
+    def pause(self):
+        self.calls.append("pause")
+        self.set_state(sonos.PAUSED)
+
+    def next(self):
+        self.calls.append("next")
+        self.play_track((self.track + 1) % len(self.queue))
+
+    def previous(self):
+        self.calls.append("previous")
+        self.play_track((self.track - 1) % len(self.queue))
+
+    def get_queue(self, start, count):
+        self.calls.append(("get_queue", start, count))
+        result = SimulatedQueue(types.SimpleNamespace(title=i)
+                                for i in self.queue[start:start + count])
+        result.total_matches = len(self.queue)
+        return result
+
+    def play_from_queue(self, index):
+        self.calls.append(("play_from_queue", index))
+        self.play_track(index)
+
+    # Changes made "elsewhere" (another controller or the speaker's own
+    # buttons), announced with the events the speaker would send.
+    def set_state(self, state):
+        self.state = state
+        self.avTransport.send(transport_state=state)
+
+    def set_volume(self, volume):
+        self._volume = volume
+        self.renderingControl.send(volume={"Master": str(volume)})
+
+    def play_track(self, index):
+        self.track = index
+        self.started = time.monotonic()
+        self.state = sonos.PLAYING
+        self.avTransport.send(transport_state=self.state,
+                              current_track=str(index + 1),
+                              current_track_duration="0:03:00",
+                              current_track_meta_data=self.metadata())
+
+    def edit_queue(self, titles):
+        self.queue = list(titles)
+        self.queue_id += 1
+        self.contentDirectory.send(
+            container_update_i_ds="Q:0,{}".format(self.queue_id))
+
+def check(name, ok, detail=""):
+    print("{:32} {}{}".format(name, "ok" if ok else "FAILED",
+                               " ({})".format(detail) if detail else ""))
+    return ok
+
+def wait_for(condition, timeout=2):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+def run_checks(hw, player, manager):
+    lcd = hw.lcd
+    status_glyph = lambda state: (lambda: lcd.glyph(ord(lcd.text(3)[1]))
+                                  == sonos.STATUS_GLYPHS[state])
+    results = [check("initial event drawn", wait_for(
+        lambda: lcd.text(0).strip() == "Track 1"), repr(lcd.text(0)))]
+
+    player.play_track(4)
+    results.append(check("track change event", wait_for(
+        lambda: lcd.text(0).strip() == "Track 5"), repr(lcd.text(0))))
+    results.append(check("playing glyph", wait_for(
+        status_glyph(sonos.PLAYING)), repr(lcd.text(3))))
+
+    # While subscribed, the transport state is never polled
+    polls = player.calls.count("get_current_transport_info")
+    player.set_state(sonos.PAUSED)
+    results.append(check("paused glyph", wait_for(
+        status_glyph(sonos.PAUSED)), repr(lcd.text(3))))
+    results.append(check("state came from the event", polls ==
+        player.calls.count("get_current_transport_info")))
+
+    player.set_volume(60)
+    hw.rf.press(UP)
+    bar = "Vol " + "\xff" * round(65 / 6) + " "  # 0xff is the ROM's block
+    results.append(check("volume from speaker", wait_for(
+        lambda: lcd.text(3).startswith(bar)), repr(lcd.text(3))))
+
+    player.avTransport.lapse()
+    player.renderingControl.lapse()
+    results.append(check("lapsed subscriptions noticed", wait_for(
+        lambda: not manager.screen.subscribed)))
+
+    hw.rf.press(BACK)
+    return all(results)
+
+def main():
+    hw = SimulatedHardware()
+    manager = Manager(AnimatedDisplay(bus=hw.bus), RFReceiver(bus=hw.bus))
+    player = SimulatedPlayer()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(
+        run_checks(hw, player, manager)))
+    thread.daemon = True
+    thread.start()
+    manager.launch(sonos.NowPlaying(player, manager.display))
+    thread.join()
+    sys.exit(0 if result and result[0] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,314 @@
 
 from . import *
 
-import soco, time, sys, traceback, collections
+import soco, requests, time, sys, os, json, traceback, collections, threading, queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
+from requests.adapters import HTTPAdapter
+
+from hardware import latency
 
 PLAYING = "PLAYING"
 PAUSED  = "PAUSED_PLAYBACK"
 STOPPED = "STOPPED"
 TRANSITIONING = "TRANSITIONING"
 
-STATUS_CHARACTERS = {
-    PLAYING: chr(1),
-    PAUSED: chr(2),
-    STOPPED: chr(3),
-    TRANSITIONING: chr(4)
+FALLBACK_POLL_INTERVAL = 5
+RESUBSCRIBE_INTERVAL = 60
+DRIFT_CHECK_INTERVAL = 30
+BACKLIGHT_TIMEOUT = 5 # after playback stops
+
+PLAYER_CACHE = os.path.expanduser("~/.homectrl/players.json")
+
+# Speakers to probe directly, in addition to any already in the cache
+SPEAKER_ADDRESSES = [i.strip() for i in
+                     os.environ.get("HOMECTRL_SPEAKERS", "").split(",")
+                     if i.strip()]
+PROBE_TIMEOUT = 2
+
+UPNP_DEVICE = "{urn:schemas-upnp-org:device-1-0}"
+
+SLOW_CALL = 1.0
+
+VOLUME_STEP = 5
+REPEAT_VOLUME_STEP = 2 # while an arrow is held
+VOLUME_BURST_TIME = 3 # s without a press before the level is read again
+
+ERROR_BANNER_TIME = 5
+
+QUEUE_CACHED_PAGES = 512 # 2048 tracks
+
+STATUS_GLYPHS = {
+    PLAYING: (0x08,0x0c,0x0e,0x0f,0x0e,0x0c,0x08,0x00),
+    PAUSED: (0x1b,0x1b,0x1b,0x1b,0x1b,0x1b,0x1b,0x00),
+    STOPPED: (0x00,0x1f,0x1f,0x1f,0x1f,0x1f,0x00,0x00),
+    TRANSITIONING: (0x00,0x0e,0x1f,0x1f,0x1f,0x0e,0x00,0x00)
 }
 
-def write_custom_chars(display):
-    display.writeChar(*[0x00 for i in range(8)], index=0)
-    display.writeChar(0x08,0x0c,0x0e,0x0f,0x0e,0x0c,0x08,0x00, index=1)
-    display.writeChar(0x1b,0x1b,0x1b,0x1b,0x1b,0x1b,0x1b,0x00, index=2)
-    display.writeChar(0x00,0x1f,0x1f,0x1f,0x1f,0x1f,0x00,0x00, index=3)
-    display.writeChar(0x00,0x0e,0x1f,0x1f,0x1f,0x0e,0x00,0x00, index=4)
+class CallStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.worst = 0
+        self.last = 0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.worst = max(self.worst, elapsed)
+        self.last = elapsed
+
+    def __str__(self):
+        return "{} calls, mean {:.0f} ms, max {:.0f} ms, last {:.0f} ms".format(
+            self.count, 1000 * self.total / max(self.count, 1),
+            1000 * self.worst, 1000 * self.last)
+
+class SessionPool:
+    # Stands in for the requests module inside SoCo so that every call to
+    # a speaker goes through one keep-alive Session per host, instead of a
+    # new TCP connection per SOAP request, and records how long each SOAP
+    # action took. Anything else is passed through to requests.
+    def __init__(self, module=requests):
+        self.module = module
+        self.sessions = {}
+        self.stats = collections.defaultdict(CallStats)
+        self.__lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+    def session(self, host):
+        with self.__lock:
+            if host not in self.sessions:
+                session = self.module.Session()
+                session.mount("http://", HTTPAdapter(pool_connections=1,
+                                                     pool_maxsize=4))
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def request(self, method, url, **kwargs):
+        host = urlsplit(url).netloc
+        action = (kwargs.get("headers") or {}).get("SOAPACTION", "")
+        action = action.strip('"').rpartition("#")[2] or urlsplit(url).path
+        start = time.monotonic()
+        try:
+            return self.session(host).request(method, url, **kwargs)
+        finally:
+            elapsed = time.monotonic() - start
+            with self.__lock:
+                self.stats[host, action].add(elapsed)
+            if elapsed > SLOW_CALL:
+                print("Slow call: {} {} took {:.2f}s".format(
+                    host, action, elapsed), file=sys.stderr)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def report(self, host=None):
+        with self.__lock:
+            return "\n".join(
+                "{} {}: {}".format(h, action, stats)
+                for (h, action), stats in sorted(self.stats.items())
+                if host is None or h.partition(":")[0] == host)
+
+sessions = SessionPool()
+latency.add_report("SoCo calls", sessions.report)
+
+for _module in ("services", "core"):
+    if hasattr(getattr(soco, _module, None), "requests"):
+        getattr(soco, _module).requests = sessions
+
+def parse_time(value):
+    # "H:MM:SS" as used by AVTransport, or None (e.g. NOT_IMPLEMENTED)
+    try:
+        h, m, s = value.split(":")
+        return int(h) * 3600 + int(m) * 60 + int(s)
+    except (AttributeError, ValueError):
+        return None
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return "{}:{:02d}:{:02d}".format(
+        seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def probe_player(ip, timeout=PROBE_TIMEOUT):
+    # One HTTP request for the speaker's device description, which names
+    # its room and UID. Returns (name, info), or None if it is not a
+    # zone player.
+    response = sessions.get(
+        "http://{}:1400/xml/device_description.xml".format(ip),
+        timeout=timeout)
+    response.raise_for_status()
+    device = ElementTree.fromstring(response.content).find(
+        UPNP_DEVICE + "device")
+    if device is None or not device.findtext(UPNP_DEVICE + "roomName"):
+        return None
+    uid = device.findtext(UPNP_DEVICE + "UDN", "")
+    if uid.startswith("uuid:"):
+        uid = uid[len("uuid:"):]
+    return device.findtext(UPNP_DEVICE + "roomName"), {"ip": ip, "uid": uid}
+
+class PlayerDirectory:
+    # Zone players by name ({"ip": ..., "uid": ...}), persisted to
+    # PLAYER_CACHE so menus can be filled without waiting for discovery.
+    def __init__(self, path=PLAYER_CACHE):
+        self.path = path
+        self.players = {}
+        self.__lock = threading.Lock()
+        self.__refreshing = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.players = json.load(f)
+        except (OSError, ValueError) as err:
+            self.players = {}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.players, f, indent=2, sort_keys=True)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as err:
+            print("Could not save {}: {!r}".format(self.path, err),
+                  file=sys.stderr)
+
+    def player(self, name):
+        # SoCo instances are cached per IP and constructing one makes no
+        # network requests.
+        return soco.SoCo(self.players[name]["ip"])
+
+    def zone_players(self):
+        return {name: self.player(name) for name in self.players}
+
+    def addresses(self):
+        return sorted(set(SPEAKER_ADDRESSES) |
+                      set(i["ip"] for i in self.players.values()))
+
+    def __replace(self, players):
+        with self.__lock:
+            changed = players != self.players
+            self.players = players
+        if changed:
+            self.save()
+        return changed
+
+    def probe(self, addresses=None, callback=None):
+        # Ask each known speaker directly, in parallel, calling callback()
+        # as soon as any answer changes the list. Returns the players that
+        # answered.
+        if addresses is None:
+            addresses = self.addresses()
+        answered = {}
+        updated = False
+        if not addresses:
+            return answered
+        with ThreadPoolExecutor(max_workers=len(addresses)) as pool:
+            for future in as_completed([pool.submit(probe_player, i)
+                                        for i in addresses]):
+                try:
+                    result = future.result()
+                except Exception as err:
+                    continue
+                if not result:
+                    continue
+                name, info = result
+                answered[name] = info
+                with self.__lock:
+                    changed = self.players.get(name) != info
+                    self.players = dict(self.players, **{name: info})
+                if changed:
+                    updated = True
+                    if callback:
+                        callback()
+        if updated:
+            self.save()
+        return answered
+
+    def discover(self, probed=None):
+        # Multicast discovery, for players we do not know the address of
+        players = {}
+        for i in soco.discover() or ():
+            players[i.player_name] = {"ip": i.ip_address, "uid": i.uid}
+        players.update(probed or {})
+        return self.__replace(players)
+
+    def refresh(self, callback=None):
+        # Probe the known speakers and then rediscover, in the background;
+        # callback() runs (on that thread) whenever the list changes. Only
+        # one refresh runs at a time.
+        with self.__lock:
+            if self.__refreshing:
+                return
+            self.__refreshing = threading.Thread(
+                target=self.__refresh, args=(callback,),
+                name="SonosDiscoveryThread")
+            self.__refreshing.daemon = True
+            self.__refreshing.start()
+
+    def __refresh(self, callback):
+        try:
+            changed = self.discover(self.probe(callback=callback))
+        except Exception as err:
+            print(repr(err), file=sys.stderr)
+            changed = False
+        finally:
+            self.__refreshing = None
+        if changed and callback:
+            callback()
+
+_directory = None
+
+def player_directory():
+    global _directory
+    if _directory is None:
+        _directory = PlayerDirectory()
+    return _directory
 
 class PlayerSelection(Menu):        
     def get_options(self):
-        self.display.displayLoadingAnimation()
-        self.players = {}
-        for i in soco.discover():
-            self.players[i.player_name] = i
-        self.display.stopLoadingAnimation()
-        return self.players
+        directory = player_directory()
+        if not directory.players:
+            directory.probe()
+        if directory.players:
+            directory.refresh(lambda: self.manager.post(self.players_changed))
+        else:
+            self.display.displayLoadingAnimation()
+            directory.discover()
+            self.display.stopLoadingAnimation()
+        self.players = directory.zone_players()
+        return self.player_options()
+
+    def player_options(self):
+        return {name: ScreenFactory(PlayerMenu, player, self.display,
+                                    name=name)
+                for name, player in self.players.items()}
+
+    def revalidate(self):
+        player_directory().refresh(
+            lambda: self.manager.post(self.players_changed))
+
+    def players_changed(self):
+        if self.manager.screen is self:
+            self.players = player_directory().zone_players()
+            self.update_options(self.player_options())
 
     def get_keys(self, options):
         return list(sorted(options))
-    
-    def selected(self, player):
-        return PlayerMenu(player, self.display)
 
 class PlayerMenu(Menu):
-    def __init__(self, player, *args):
+    # Opening the menu makes no network requests: the name comes from the
+    # directory and Now Playing is only built when it is selected.
+    def __init__(self, player, *args, name=None):
         super().__init__(*args)
         self.__player = player
+        self.__name = name
 
     def selected(self, option):
         if callable(option):
@@ -51,112 +319,801 @@ class PlayerMenu(Menu):
     def get_options(self):
         return collections.OrderedDict((
             ("Now Playing ({})".format(
-                self.__player.player_name), NowPlaying(
-                    self.__player, self.display)),
-            ("Next Track", (lambda p=self.__player: p.next())),
-            ("Previous Track", (lambda p=self.__player: p.previous()))
+                self.__name or self.__player.player_name), ScreenFactory(
+                    NowPlaying, self.__player, self.display)),
+            ("Queue", ScreenFactory(QueueBrowser, self.__player,
+                                    self.display)),
+            ("Next Track", (lambda p=self.__player:
+                            command_worker(p).submit(
+                                lambda: coordinator(p).next()))),
+            ("Previous Track", (lambda p=self.__player:
+                                command_worker(p).submit(
+                                    lambda: coordinator(p).previous())))
         ))
 
+class CommandWorker:
+    # Runs SoCo calls for one speaker on its own thread, in order, so that
+    # the Manager thread never waits on HTTP. Calls meant for the group,
+    # volume included, go through coordinator() on this thread. Volume
+    # changes are kept as a locally tracked target level; however many
+    # presses arrive while a SetVolume is in flight, only one more is sent,
+    # for the latest target. The level is only trusted for one burst of
+    # presses, as it may have been changed elsewhere since.
+    def __init__(self, player):
+        self.player = player
+        self.volume = None
+        self.__delta = 0
+        self.__press_time = 0
+        self.__volume_callbacks = []
+        self.__volume_queued = False
+        self.__lock = threading.Lock()
+        self.__queue = queue.Queue()
+        thread = threading.Thread(target=self.__run, name="SonosCommandThread")
+        thread.daemon = True
+        thread.start()
+
+    def __run(self):
+        while True:
+            func, args, callback, errback = self.__queue.get()
+            try:
+                result = func(*args)
+            except Exception as err:
+                print(repr(err), file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+                if errback:
+                    errback(err)
+            else:
+                if callback:
+                    callback(result)
+
+    def submit(self, func, *args, callback=None, errback=None):
+        self.__queue.put((func, args, callback, errback))
+
+    def observe_volume(self, volume):
+        # A level reported by the speaker only replaces ours when we have
+        # no change of our own waiting to be sent.
+        with self.__lock:
+            if not self.__volume_queued:
+                self.volume = volume
+
+    def forget_volume(self):
+        # Read the level from the speaker on the next press
+        with self.__lock:
+            self.__forget_volume()
+
+    def __forget_volume(self):
+        # With the lock held; a change waiting to be sent is kept
+        if not self.__volume_queued:
+            self.volume = None
+            self.__delta = 0
+
+    def adjust_volume(self, delta, callback=None):
+        now = time.monotonic()
+        with self.__lock:
+            if self.__press_time + VOLUME_BURST_TIME < now:
+                self.__forget_volume()
+            self.__press_time = now
+            if self.volume is None:
+                self.__delta += delta
+                target = None
+            else:
+                self.volume = target = max(0, min(100, self.volume + delta))
+            if callback:
+                self.__volume_callbacks.append(callback)
+            if not self.__volume_queued:
+                self.__volume_queued = True
+                self.submit(self.__apply_volume, errback=self.__volume_failed)
+        return target
+
+    def __take_volume(self):
+        with self.__lock:
+            self.__volume_queued = False
+            callbacks, self.__volume_callbacks = self.__volume_callbacks, []
+            return self.volume, callbacks
+
+    def __apply_volume(self):
+        # observe_volume() leaves self.volume alone while this is queued,
+        # and adjust_volume() only adds to __delta while it is unknown.
+        with self.__lock:
+            known = self.volume is not None
+        if not known:
+            current = coordinator(self.player).volume
+            with self.__lock:
+                self.volume = max(0, min(100, current + self.__delta))
+                self.__delta = 0
+        target, callbacks = self.__take_volume()
+        coordinator(self.player).volume = target
+        for i in callbacks:
+            i(target)
+
+    def __volume_failed(self, err):
+        target, callbacks = self.__take_volume()
+        try:
+            current = coordinator(self.player).volume
+        except Exception:
+            current = None
+        with self.__lock:
+            # A change queued since then will report its own result
+            if self.__volume_queued:
+                return
+            self.volume = current
+        if current is not None:
+            for i in callbacks:
+                i(current)
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+def player_uid(player):
+    # SoCo.uid makes a request on a fresh instance; the directory already
+    # knows the uid of every speaker it has seen.
+    for info in player_directory().players.values():
+        if info.get("ip") == player.ip_address and info.get("uid"):
+            return info["uid"]
+    return player.uid
+
+def command_worker(player):
+    # One worker per speaker as the screens know it (a group member, not
+    # its coordinator, which would take a request to find), so everything
+    # sent about that speaker runs in the order it was asked for.
+    uid = player_uid(player)
+    with _workers_lock:
+        if uid not in _workers:
+            _workers[uid] = CommandWorker(player)
+        return _workers[uid]
+
+def submit_for(screen, worker, func, *args, callback=None, errback=None,
+               stale=None):
+    # Run func on worker and pass its result or error to callback or
+    # errback on the Manager thread. Screens set a new screen.visit on
+    # every enter and exit; if the screen is no longer showing the visit
+    # that asked, stale gets the result instead.
+    visit = screen.visit
+    def deliver(handler, stale=None):
+        def run(value):
+            if screen.visit is visit and screen.manager.screen is screen:
+                handler and handler(value)
+            elif stale:
+                stale(value)
+        return lambda value: screen.manager.post(lambda: run(value))
+    worker.submit(func, *args, callback=deliver(callback, stale),
+                  errback=deliver(errback))
+
+class EventSubscription:
+    # Subscribes to one of a player's UPnP event services and hands the
+    # variables of every event it pushes to callback, from a daemon thread.
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.subscription = None
+
+    @property
+    def active(self):
+        sub = self.subscription
+        return bool(sub and sub.is_subscribed and sub.time_left)
+
+    def start(self):
+        self.stop()
+        try:
+            sub = self.service.subscribe(auto_renew=True)
+        except Exception as err:
+            print("Subscribing to {} failed: {!r}".format(
+                self.service.service_type, err), file=sys.stderr)
+            return False
+        self.subscription = sub
+        thread = threading.Thread(target=self.__forward, args=(sub,),
+                                  name="SonosEventThread")
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def stop(self):
+        sub, self.subscription = self.subscription, None
+        if sub:
+            try:
+                sub.unsubscribe()
+            except Exception as err:
+                print(repr(err), file=sys.stderr)
+
+    def __forward(self, sub):
+        while self.subscription is sub:
+            try:
+                event = sub.events.get(timeout=1)
+            except queue.Empty:
+                continue
+            self.callback(event.variables)
+
+class GroupCache:
+    # Coordinator lookups (a topology request each) cached per player IP.
+    # The cache is only trusted while a zone group topology subscription is
+    # running, and is dropped whenever an event on it reports that the
+    # groups may have changed. Without one, every lookup asks the speaker,
+    # and subscribing is retried every RESUBSCRIBE_INTERVAL.
+    def __init__(self):
+        self.__coordinators = {}
+        self.__lock = threading.Lock()
+        self.__watch_lock = threading.Lock()
+        self.__subscription = None
+        self.__subscribe_time = 0
+        self.__initial = False
+
+    def coordinator(self, player):
+        if not self.watch(player):
+            self.invalidate()
+            return player.group.coordinator
+        with self.__lock:
+            coordinator = self.__coordinators.get(player.ip_address)
+        if coordinator is None:
+            coordinator = player.group.coordinator
+            with self.__lock:
+                self.__coordinators[player.ip_address] = coordinator
+        return coordinator
+
+    def watch(self, player):
+        # Whether the subscription is running, starting it if need be
+        with self.__watch_lock:
+            if self.__subscription is not None:
+                if self.__subscription.active:
+                    return True
+                self.__subscription.stop()
+                self.__subscription = None
+            if self.__subscribe_time + RESUBSCRIBE_INTERVAL > time.time():
+                return False
+            self.__subscribe_time = time.time()
+            self.__initial = True
+            subscription = EventSubscription(player.zoneGroupTopology,
+                                             self.topology_event)
+            if not subscription.start():
+                return False
+            self.__subscription = subscription
+            return subscription.active
+
+    def topology_event(self, variables):
+        # Every subscription starts with an event describing the current
+        # state, which the lookups made alongside it already reflect.
+        if self.__initial:
+            self.__initial = False
+            return
+        self.invalidate()
+
+    def invalidate(self):
+        with self.__lock:
+            self.__coordinators.clear()
+
+_groups = GroupCache()
+
+def coordinator(player):
+    return _groups.coordinator(player)
+
 class NowPlaying(Screen):
+    # Every speaker call, including finding the group coordinator and
+    # (un)subscribing, runs on the speaker's CommandWorker; results come
+    # back to the Manager thread through manager.post(), so input is never
+    # held up by the network.
     def __init__(self, player, *args):
         super().__init__(*args)
-        self.__player = player.group.coordinator
+        self.__member = player
+        self.__worker = None
+        self.visit = None
+        self.__syncing = False
 
         self.__volume_time = None
+        self.__banner_time = None
+        self.__retry = RetryPolicy()
         self.__play_time = 0
-        self.__tick_time = 0
+        self.__sync_time = 0
+        self.__subscribe_time = 0
+        self.__volume = None
+        self.__subscriptions = ()
 
     def enter(self):
-        write_custom_chars(self.display)
+        self.__worker = command_worker(self.__member)
+        self.__worker.forget_volume()
+        self.visit = object()
+        self.__syncing = False
         self.__info = {}
         self.__state = None
+        self.__volume = None
+        self.__anchor = None
+        self.__resync = True
+        self.__banner_time = None
+        self.__retry = RetryPolicy()
         super().enter()
+        self.subscribe()
 
     def exit(self):
-        for i in range(3):
+        self.visit = object()
+        self.unsubscribe()
+        for i in range(4):
             self.display.stopRow(i, skip_reprint=True)
         super().exit()
-        
+
+    def subscribe(self):
+        self.__subscribe_time = time.time()
+        submit_for(self, self.__worker, self.__start_subscriptions,
+                   callback=self.__subscribed,
+                   stale=self.__stop_subscriptions)
+
+    def __start_subscriptions(self):
+        # Runs on the command thread
+        player = coordinator(self.__member)
+        subscriptions = tuple(
+            EventSubscription(service, lambda v, f=handler:
+                              self.manager.post(lambda: self.__event(f, v)))
+            for service, handler in (
+                    (player.avTransport, self.transport_event),
+                    (player.renderingControl, self.rendering_event)))
+        for i in subscriptions:
+            i.start()
+        return subscriptions
+
+    def __subscribed(self, subscriptions):
+        self.unsubscribe()
+        self.__subscriptions = subscriptions
+
+    def __stop_subscriptions(self, subscriptions):
+        if subscriptions:
+            self.__worker.submit(lambda: [i.stop() for i in subscriptions])
+
+    def unsubscribe(self):
+        subscriptions, self.__subscriptions = self.__subscriptions, ()
+        self.__stop_subscriptions(subscriptions)
+
+    def __event(self, handler, variables):
+        # Events are handled on the Manager thread, and dropped if they
+        # arrive after the screen has been left.
+        if self.manager.screen is self:
+            handler(variables)
+
+    @property
+    def subscribed(self):
+        return bool(self.__subscriptions) and all(
+            i.active for i in self.__subscriptions)
+
+    def transport_event(self, variables):
+        meta = variables.get("current_track_meta_data")
+        if meta is not None:
+            self.__resync = True
+        if meta is not None and not isinstance(meta, str):
+            self.update_track({
+                "title": getattr(meta, "title", "") or "",
+                "artist": getattr(meta, "creator", "") or "",
+                "album": getattr(meta, "album", "") or ""})
+        if variables.get("current_track_duration"):
+            self.update_track(
+                {"duration": variables["current_track_duration"]})
+        if variables.get("transport_state"):
+            self.update_state(variables["transport_state"])
+
+    def rendering_event(self, variables):
+        volume = variables.get("volume")
+        if isinstance(volume, dict):
+            volume = volume.get("Master")
+        if volume is not None:
+            self.__worker.observe_volume(int(volume))
+            self.volume_changed(self.__worker.volume)
+
+    def volume_changed(self, volume):
+        if volume is not None and self.__volume != volume:
+            self.__volume = volume
+            if self.__volume_time:
+                self.draw_volume(volume)
+
+    def toggle_playback(self, state):
+        # Runs on the command thread
+        player = coordinator(self.__member)
+        if state is None:
+            state = player.get_current_transport_info()[
+                "current_transport_state"]
+        if state != PLAYING:
+            player.play()
+            return PLAYING
+        player.pause()
+        return PAUSED
+
     def input(self, button):
+        # Commands go to the coordinator's worker thread; the display is
+        # updated optimistically and corrected from the worker's results
+        # and pushed events.
+        post = lambda f: (lambda v: self.manager.post(
+            lambda: self.__event(f, v)))
+        kind = getattr(button, "kind", PRESS)
+        if kind == REPEAT and button in ARROWS:
+            step = REPEAT_VOLUME_STEP
+        elif kind == PRESS:
+            step = VOLUME_STEP
+        else:
+            return self
         if button in ARROWS:
-            vol = self.__player.volume
-            if button == UP:
-                vol += 5
-            elif button == DOWN:
-                vol -= 5
-            self.__player.volume = vol
-            self.draw_volume(vol)
+            if self.__banner_time:
+                self.display.stopRow(3, skip_reprint=True)
+                self.__banner_time = None
+            vol = self.__worker.adjust_volume(
+                step if button == UP else -step,
+                callback=post(self.volume_changed))
             self.__volume_time = time.time()
+            if vol is not None:
+                self.__volume = vol
+                self.draw_volume(vol)
         elif button == A:
-            if self.__player.get_current_transport_info()["current_transport_state"] != "PLAYING":
+            if self.__state != PLAYING:
                 self.display.lit = True
-                self.__player.play()
-            else:
-                self.__player.pause()
+            self.__worker.submit(self.toggle_playback, self.__state,
+                                 callback=post(self.update_state))
+            if self.__state is not None:
+                self.update_state(PAUSED if self.__state == PLAYING
+                                  else PLAYING)
         elif button == MENU:
             return None
         return self
 
+    def next_tick(self):
+        # While the speaker is failing, a pending resync waits for the
+        # retry policy instead of ticking straight away.
+        wait = self.__retry.remaining()
+        if self.__resync and not wait and not self.__syncing:
+            return 0
+        now = time.time()
+        position = self.position()
+        if self.__state == PLAYING:
+            delay = 1 if position is None else 1 - position % 1
+        else:
+            # The display is not changing; wake for whatever is due next:
+            # a poll or resubscription (no sooner than the retry policy
+            # allows) or turning the backlight off.
+            subscribed = self.subscribed
+            due = self.__sync_time + self.poll_interval(subscribed)
+            if not subscribed:
+                due = min(due, self.__subscribe_time + RESUBSCRIBE_INTERVAL)
+            # An answer from a sync in flight wakes the Manager anyway
+            delay = max(due - now, wait) if not self.__syncing else 60
+            if self.__play_time + BACKLIGHT_TIMEOUT > now:
+                delay = min(delay, self.__play_time + BACKLIGHT_TIMEOUT - now)
+        if self.__resync and not self.__syncing:
+            delay = min(delay, wait)
+        if self.__volume_time:
+            delay = min(delay, self.__volume_time + 2 - time.time())
+        if self.__banner_time:
+            delay = min(delay,
+                        self.__banner_time + ERROR_BANNER_TIME - time.time())
+        return delay
+
+    def __status_hidden(self):
+        # Row 3 is showing the volume or an error instead of the status
+        return bool(self.__volume_time or self.__banner_time)
+
+    # The position is kept as an anchor: where the track was at a given
+    # time.monotonic(), advanced locally while playing. The speaker is only
+    # asked again when the track or transport state changes, or every
+    # DRIFT_CHECK_INTERVAL.
+    def position(self):
+        if self.__anchor is None:
+            return None
+        position, at = self.__anchor
+        if self.__state == PLAYING:
+            position += time.monotonic() - at
+            duration = parse_time(self.__info.get("duration"))
+            if duration:
+                position = min(position, duration)
+        return position
+
+    def advance_position(self):
+        position = self.position()
+        if position is not None:
+            self.update_track({"position": format_time(position)})
+
+    def update_track(self, info):
+        for n, i in enumerate(("title","artist","album")):
+            if i in info and self.__info.get(i) != info[i]:
+                self.display.animateRow(n,info[i])
+                self.__info[i] = info[i]
+        for i, draw in (("duration", self.draw_duration),
+                        ("position", self.draw_position)):
+            if i in info and self.__info.get(i) != info[i]:
+                self.__info[i] = info[i]
+                if not self.__status_hidden():
+                    draw()
+
+    def update_state(self, state):
+        if self.__state != state:
+            position = self.position()
+            self.__state = state
+            if position is not None:
+                self.__anchor = (position, time.monotonic())
+            self.__resync = True
+            if not self.__status_hidden():
+                self.draw_state()
+        if state in (PAUSED,STOPPED):
+            if self.__play_time + BACKLIGHT_TIMEOUT < time.time():
+                self.display.lit = False
+        else:
+            self.__play_time = time.time()
+            self.display.lit = True
+
+    def poll_interval(self, subscribed):
+        return DRIFT_CHECK_INTERVAL if subscribed else FALLBACK_POLL_INTERVAL
+
+    def sync(self, subscribed):
+        # A resync asked for while this one is in flight is kept; one that
+        # fails is asked for again once the retry policy allows.
+        self.__syncing = True
+        self.__resync = False
+        submit_for(self, self.__worker, self.__fetch, subscribed,
+                   callback=self.__synced, errback=self.__sync_failed)
+
+    def __fetch(self, subscribed):
+        # Runs on the command thread
+        player = coordinator(self.__member)
+        info = player.get_current_track_info()
+        status = None
+        if not subscribed:
+            status = player.get_current_transport_info()
+        return info, status, time.monotonic()
+
+    def __synced(self, result):
+        info, status, at = result
+        self.__syncing = False
+        resync = self.__resync
+        position = parse_time(info.get("position"))
+        self.__anchor = None if position is None else (position, at)
+        self.update_track(info)
+        if status:
+            self.update_state(status["current_transport_state"])
+        self.__resync = resync
+        self.__sync_time = time.time()
+        if self.__retry.succeeded() and self.__banner_time:
+            self.__banner_time = time.time() - ERROR_BANNER_TIME
+            self.tick()
+
+    def __sync_failed(self, err):
+        self.__syncing = False
+        self.__resync = True
+        self.show_error(err, self.__retry.failed())
+
     def tick(self):
+        # Track and transport changes are pushed by the event subscriptions
+        # and the position is advanced locally, so the speaker is only
+        # polled to resynchronise, or slowly when the subscriptions are not
+        # working. Failures back off through the retry policy and show a
+        # banner on the status row.
         tt = time.time()
-        if self.__tick_time + 0.5 > tt:
-            return self
-        try:
-            info = self.__player.get_current_track_info()
-            status = self.__player.get_current_transport_info()
-            for n, i in enumerate(("title","artist","album")):
-                if self.__info.get(i) != info[i]:
-                    self.display.animateRow(n,info[i])
-                    self.__info[i] = info[i]
-            if self.__volume_time:
-                if self.__volume_time + 2 < tt:
+        if self.__retry.ready() and not self.__syncing:
+            subscribed = self.subscribed
+            if (not subscribed and
+                self.__subscribe_time + RESUBSCRIBE_INTERVAL < tt):
+                self.subscribe()
+            if (self.__resync or
+                self.__sync_time + self.poll_interval(subscribed) < tt):
+                self.sync(subscribed)
+        if self.__state:
+            self.update_state(self.__state)
+        self.advance_position()
+        if self.__volume_time and self.__volume_time + 2 < tt:
+            self.__volume_time = None
+            if not self.__status_hidden():
+                self.draw_status()
+        if self.__banner_time and \
+           self.__banner_time + ERROR_BANNER_TIME <= tt:
+            self.__banner_time = None
+            self.display.stopRow(3, skip_reprint=True)
+            if not self.__status_hidden():
+                with self.display.frame():
+                    self.display.clearRow(3)
                     self.draw_status()
-                    self.__volume_time = None
-                else:
-                    pass # volume should already be drawn
-            else:
-                if self.__info.get("duration") != info["duration"]:
-                    self.draw_duration(info["duration"])
-                if self.__info.get("position") != info["position"]:
-                    self.draw_position(info["position"])
-                if self.__state != status["current_transport_state"]:
-                    self.draw_state(status["current_transport_state"])
-            if status["current_transport_state"] in (PAUSED,STOPPED):
-                if self.__play_time + 5 < tt:
-                    self.display.lit = False
-            else:
-                self.__play_time = tt
-                self.display.lit = True
-            self.__tick_time = tt
-        except Exception as err:
-            print(repr(err),file=sys.stderr)
-            traceback.print_exc(file=sys.stdout)
-            self.display.animateRow(3,repr(err))
-            time.sleep(10)
-            self.display.stopRow(3,clear=True)
         return self
 
+    def show_error(self, err, delay):
+        if self.__volume_time:
+            return # the volume bar has the row; the next failure will show
+        self.__banner_time = time.time()
+        self.display.animateRow(3, "{}, retrying in {:.0f}s".format(
+            type(err).__name__, delay))
+
     def draw_volume(self, v=None):
-        vol = v or self.__player.volume
-        self.display.insert(3,0,"Vol " + "\xff"*round(vol/6) + " "*(16-round(vol/6)))
+        vol = self.__volume if v is None else v
+        self.display.insert(3,0,"Vol " + "█"*round(vol/6) + " "*(16-round(vol/6)))
 
     def draw_status(self):
-        self.draw_duration()
-        self.draw_position()
-        self.draw_state()
+        with self.display.frame():
+            self.draw_duration()
+            self.draw_position()
+            self.draw_state()
 
     def draw_duration(self, d=None):
         if d:
             self.__info["duration"] = d
-        self.display.insert(3, 10, " / " + self.__info["duration"])
+        self.display.insert(3, 10, " / " + self.__info.get("duration", ""))
 
     def draw_position(self, p=None):
         if p:
             self.__info["position"] = p
-        self.display.insert(3, 3, self.__info["position"])
+        self.display.insert(3, 3, self.__info.get("position", ""))
 
     def draw_state(self, s=None):
         if s:
             self.__state = s
+        glyph = STATUS_GLYPHS.get(self.__state)
         self.display.insert(
-            3, 0, " " + STATUS_CHARACTERS[self.__state] + " ")
+            3, 0, " " + (self.display.glyph(*glyph) if glyph else " ") + " ")
+
+class QueueSource:
+    # Pages of a coordinator's queue for a PagedMenu, valued by their
+    # (0-based) queue index. One is kept per coordinator, holding the pages
+    # read so far and the queue's update id they were read at.
+    def __init__(self, player):
+        self.player = player
+        self.cache = PageCache(QUEUE_CACHED_PAGES)
+        self.queue_id = None
+
+    def fetch(self, start, count):
+        queue = self.player.get_queue(start, count)
+        items = [(getattr(item, "title", "") or "", start + n)
+                 for n, item in enumerate(queue)]
+        return items, queue.total_matches
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+def queue_source(player):
+    uid = player_uid(player)
+    with _queues_lock:
+        if uid not in _queues:
+            _queues[uid] = QueueSource(player)
+        return _queues[uid]
+
+class QueueBrowser(PagedMenu):
+    # Pages through the queue as it is scrolled, marking the current track
+    # from transport events and playing whichever track is selected. Pages
+    # stay cached, across visits too, until a content directory event says
+    # the queue changed. Without that subscription they are read afresh on
+    # every visit. Finding the coordinator and (un)subscribing run on the
+    # speaker's CommandWorker; pages are only fetched once that is done.
+    def __init__(self, player, *args):
+        super().__init__(*args, cached_pages=QUEUE_CACHED_PAGES)
+        self.__member = player
+        self.__worker = None
+        self.visit = None
+        self.__current = None
+        self.__queue = None
+        self.__subscriptions = ()
+        self.__early = []
+        self.__starting = False
+        self.__error = None
+        self.__retry = RetryPolicy()
+
+    def get_source(self):
+        return None # set once the coordinator is known
+
+    def get_cache(self):
+        if self.source is None:
+            return super().get_cache()
+        return self.source.cache
+
+    def enter(self):
+        self.__worker = command_worker(self.__member)
+        self.visit = object()
+        self.__current = None
+        self.__queue = None
+        self.__early = []
+        self.__error = None
+        self.__retry = RetryPolicy()
+        super().enter()
+        self.start()
+
+    def exit(self):
+        self.visit = object()
+        subscriptions, self.__subscriptions = self.__subscriptions, ()
+        self.__stop_subscriptions(subscriptions)
+        super().exit()
+
+    def start(self):
+        self.__starting = True
+        submit_for(self, self.__worker, self.__start_subscriptions,
+                   callback=self.__started, errback=self.__failed,
+                   stale=lambda result: self.__stop_subscriptions(result[1]))
+
+    def __start_subscriptions(self):
+        # Runs on the command thread
+        player = coordinator(self.__member)
+        subscriptions = tuple(
+            EventSubscription(service, lambda v, f=handler:
+                              self.manager.post(lambda: self.__event(f, v)))
+            for service, handler in (
+                    (player.avTransport, self.transport_event),
+                    (player.contentDirectory, self.content_event)))
+        for i in subscriptions:
+            i.start()
+        return queue_source(player), subscriptions
+
+    def __stop_subscriptions(self, subscriptions):
+        if subscriptions:
+            self.__worker.submit(lambda: [i.stop() for i in subscriptions])
+
+    def __started(self, result):
+        source, self.__subscriptions = result
+        self.__starting = False
+        self.__error = None
+        self.__retry.succeeded()
+        if not self.__subscriptions[1].active:
+            source.queue_id = None
+            source.cache.clear()
+        # Events that beat us here are checked against the cache first
+        self.__queue = source
+        early, self.__early = self.__early, []
+        for handler, variables in early:
+            handler(variables)
+        self.set_source(source)
+
+    def __failed(self, err):
+        self.__starting = False
+        self.__error = (err, self.__retry.failed())
+        self.draw()
+
+    def next_tick(self):
+        if self.__error and not self.__starting:
+            return self.__retry.remaining()
+        return None
+
+    def tick(self):
+        if self.__error and not self.__starting and self.__retry.ready():
+            self.start()
+        return self
+
+    def draw(self):
+        if self.source is not None or not self.__error:
+            return super().draw()
+        err, delay = self.__error
+        with self.display.frame():
+            self.display.clearRow(0)
+            self.display.insert(1, 2, type(err).__name__, clear=True)
+            self.display.insert(2, 2, "retrying in {:.0f}s".format(delay),
+                                clear=True)
+            self.display.clearRow(3)
+
+    def __event(self, handler, variables):
+        if self.manager.screen is not self:
+            return
+        if self.__queue is None:
+            self.__early.append((handler, variables))
+        else:
+            handler(variables)
+
+    def transport_event(self, variables):
+        track = variables.get("current_track")
+        if track is not None:
+            try:
+                current = int(track) - 1
+            except ValueError:
+                return
+            if current != self.__current:
+                self.__current = current
+                self.draw()
+
+    def content_event(self, variables):
+        # container_update_i_ds is like "Q:0,12"; the queue is Q:0 and the
+        # number changes with every edit. The first event after subscribing
+        # reports the current one, to be checked against the cached pages.
+        ids = (variables.get("container_update_i_ds") or "").split(",")
+        queue_id = dict(zip(ids[::2], ids[1::2])).get("Q:0")
+        if queue_id is None:
+            return
+        source = self.__queue
+        if source.queue_id is not None and queue_id != source.queue_id:
+            if self.source is source:
+                self.invalidate()
+            else:
+                source.cache.clear()
+        source.queue_id = queue_id
+
+    def label(self, index, label):
+        if index == self.__current:
+            return self.display.glyph(*STATUS_GLYPHS[PLAYING]) + label
+        return " " + label
+
+    def selected(self, index, value):
+        self.__worker.submit(
+            lambda: coordinator(self.__member).play_from_queue(value))
+        self.__current = value
+        self.draw()
+        return self
+